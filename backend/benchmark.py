@@ -0,0 +1,319 @@
+import argparse
+import functools
+import heapq
+import json
+import math
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+from map_generator import generate_layout
+from map_loader import build_map as build_layout_map
+from map_model import Map
+
+
+def legacy_find_route(map_obj, start, goal):
+    # The dict-and-tuple A* that Map.find_route used before SearchEngine,
+    # kept here as the baseline to compare against.
+    def heuristic_cost_estimate(current, goal):
+        return abs(current[1] - goal[1]) + abs(current[2] - goal[2]) + abs(current[0] - goal[0]) * 5
+
+    def reconstruct_path(came_from, current):
+        total_path = [current]
+        while current in came_from:
+            current = came_from[current]
+            total_path.append(current)
+        return total_path[::-1]
+
+    open_set = []
+    heapq.heappush(open_set, (0, start))
+    came_from = {}
+    g_score = {start: 0}
+    f_score = {start: heuristic_cost_estimate(start, goal)}
+
+    while open_set:
+        _, current = heapq.heappop(open_set)
+        if current == goal:
+            return reconstruct_path(came_from, current)
+
+        floor, x, y = current
+        for dx, dy in [(1, 0), (-1, 0), (0, -1), (0, 1)]:
+            new_x, new_y = x + dx, y + dy
+            if map_obj.in_bounds(floor, new_x, new_y):
+                if map_obj.is_open(floor, new_x, new_y):
+                    neighbor = (floor, new_x, new_y)
+                    tentative_g_score = g_score[current] + 1
+                    if tentative_g_score < g_score.get(neighbor, math.inf):
+                        came_from[neighbor] = current
+                        g_score[neighbor] = tentative_g_score
+                        f_score[neighbor] = tentative_g_score + heuristic_cost_estimate(neighbor, goal)
+                        heapq.heappush(open_set, (f_score[neighbor], neighbor))
+
+        for neighbor in map_obj.stairs.get(current, ()):
+            tentative_g_score = g_score[current] + 1
+            if tentative_g_score < g_score.get(neighbor, math.inf):
+                came_from[neighbor] = current
+                g_score[neighbor] = tentative_g_score
+                f_score[neighbor] = tentative_g_score + heuristic_cost_estimate(neighbor, goal)
+                heapq.heappush(open_set, (f_score[neighbor], neighbor))
+
+    return None
+
+
+def build_map(num_floors, height, wall_density, num_stairs, seed, width=None):
+    rng = random.Random(seed)
+    width = width or height
+    maps = [
+        [['X' if rng.random() < wall_density else '.' for _ in range(width)] for _ in range(height)]
+        for _ in range(num_floors)
+    ]
+    map_obj = Map(maps)
+    for floor in range(num_floors - 1):
+        for _ in range(num_stairs):
+            x, y = rng.randrange(height), rng.randrange(width)
+            map_obj.add_stairs(floor, x, y, floor + 1, x, y)
+    return map_obj
+
+
+def random_queries(map_obj, count, seed):
+    rng = random.Random(seed)
+
+    def open_cell():
+        while True:
+            floor = rng.randrange(map_obj.num_floors)
+            height, width = map_obj.floor_dims[floor]
+            x, y = rng.randrange(height), rng.randrange(width)
+            if map_obj.is_open(floor, x, y):
+                return floor, x, y
+
+    return [(open_cell(), open_cell()) for _ in range(count)]
+
+
+def time_queries(find_route, queries):
+    routes = []
+    started = time.perf_counter()
+    for start, goal in queries:
+        routes.append(find_route(start, goal))
+    return time.perf_counter() - started, routes
+
+
+def count_expanded(find_route, engine, queries):
+    expanded = 0
+    for start, goal in queries:
+        find_route(start, goal)
+        expanded += engine.expanded
+    return expanded
+
+
+def compare(args):
+    for size in args.size:
+        map_obj = build_map(args.floors, size, args.walls, args.stairs, args.seed)
+        queries = random_queries(map_obj, args.queries, args.seed)
+        engine = map_obj.search_engine()
+
+        legacy_time, legacy_routes = time_queries(lambda s, g: legacy_find_route(map_obj, s, g), queries)
+        engine_time, engine_routes = time_queries(engine.find_route, queries)
+        same = legacy_routes == engine_routes
+        print(f"{args.floors}x{size}x{size}: legacy {legacy_time * 1000:.1f} ms, "
+              f"engine {engine_time * 1000:.1f} ms, speedup {legacy_time / engine_time:.2f}x, "
+              f"identical routes: {same}")
+
+        # The floor-weighted Manhattan estimate can overestimate, so it is
+        # not a fair baseline for the exact searches; with a vertical cost
+        # of 1 it is a lower bound on these maps, whose stairs keep x and y.
+        cross_floor = [(start, goal) for start, goal in queries if start[0] != goal[0]]
+        engine.find_route(*queries[0], heuristic='alt')
+        alt_time, alt_routes = time_queries(lambda s, g: engine.find_route(s, g, 'alt'), cross_floor)
+        manhattan_time, manhattan_routes = time_queries(engine.find_route, cross_floor)
+        admissible = functools.partial(engine.find_route, vertical_cost=1)
+        admissible_time, admissible_routes = time_queries(admissible, cross_floor)
+        bidirectional_time, bidirectional_routes = time_queries(engine.find_route_bidirectional, cross_floor)
+        shorter = sum(1 for a, m in zip(alt_routes, manhattan_routes) if a and m and len(a) < len(m))
+        print(f"  {len(cross_floor)} cross-floor queries: manhattan {manhattan_time * 1000:.1f} ms / "
+              f"{count_expanded(engine.find_route, engine, cross_floor)} expanded, "
+              f"admissible manhattan {admissible_time * 1000:.1f} ms / "
+              f"{count_expanded(admissible, engine, cross_floor)} expanded, "
+              f"alt {alt_time * 1000:.1f} ms / "
+              f"{count_expanded(lambda s, g: engine.find_route(s, g, 'alt'), engine, cross_floor)} expanded, "
+              f"bidirectional {bidirectional_time * 1000:.1f} ms / "
+              f"{count_expanded(engine.find_route_bidirectional, engine, cross_floor)} expanded, "
+              f"alt shorter on {shorter}")
+        lengths = [len(r or ()) for r in admissible_routes]
+        if lengths != [len(r or ()) for r in alt_routes] or lengths != [len(r or ()) for r in bidirectional_routes]:
+            print("  admissible manhattan, alt and bidirectional route lengths differ")
+
+
+def measure_build(num_floors, height, width, args):
+    # Peak traced memory while the map and its search engine are built.
+    # Tracing slows allocation down a lot, so timings are taken separately.
+    tracemalloc.start()
+    map_obj = build_map(num_floors, height, args.walls, args.stairs, args.seed, width)
+    map_obj.search_engine()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return map_obj, peak
+
+
+def scaling(args):
+    shapes = [(1, size, int(size * args.aspect)) for size in args.size]
+    shapes += [(floors, args.floor_size, int(args.floor_size * args.aspect)) for floors in args.floors]
+    print("floors  height   width       cells  build s  memory MB  p50 ms  p99 ms  max ms")
+    for num_floors, height, width in shapes:
+        started = time.perf_counter()
+        map_obj = build_map(num_floors, height, args.walls, args.stairs, args.seed, width)
+        engine = map_obj.search_engine()
+        build_time = time.perf_counter() - started
+        del map_obj, engine
+        map_obj, peak = measure_build(num_floors, height, width, args)
+
+        engine = map_obj.search_engine()
+        latencies = []
+        for start, goal in random_queries(map_obj, args.queries, args.seed):
+            started = time.perf_counter()
+            engine.find_route(start, goal)
+            latencies.append((time.perf_counter() - started) * 1000)
+        p50, p99 = percentiles(latencies)
+        print(f"{num_floors:6d} {height:7d} {width:7d} {map_obj.num_cells:11d} {build_time:8.2f} "
+              f"{peak / 1e6:10.1f} {p50:7.2f} {p99:7.2f} {max(latencies):7.2f}")
+        del map_obj, engine
+
+
+def percentiles(latencies):
+    latencies = sorted(latencies)
+    return latencies[len(latencies) // 2], latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+
+
+def measure_operation(operation, calls, engine=None):
+    # Latency per call in ms, nodes the search engine expanded per call when
+    # there is one, and the peak traced memory of one pass over the calls.
+    latencies = []
+    expanded = []
+    for call in calls:
+        if engine is not None:
+            engine.expanded = 0
+        started = time.perf_counter()
+        operation(*call)
+        latencies.append((time.perf_counter() - started) * 1000)
+        if engine is not None:
+            expanded.append(engine.expanded)
+    tracemalloc.start()
+    for call in calls:
+        operation(*call)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    p50, p99 = percentiles(latencies)
+    result = {"calls": len(calls), "p50_ms": p50, "p99_ms": p99, "max_ms": max(latencies), "peak_bytes": peak}
+    if engine is not None:
+        result["expanded_mean"] = sum(expanded) / len(expanded)
+        result["expanded_p99"] = percentiles(expanded)[1]
+    return result
+
+
+def suite(args):
+    # find_route, get_room_coordinates and print_map on generated buildings,
+    # written to --output as JSON so runs can be compared across versions.
+    results = []
+    for size in args.size:
+        layout = generate_layout(args.floors, size, None, args.spacing, args.walls, args.stairs, args.seed)
+        tracemalloc.start()
+        map_obj = build_layout_map(layout, Map)
+        map_obj.search_engine()
+        map_obj.components()
+        _, build_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        rng = random.Random(args.seed)
+        rooms = [(name, cell) for name, cell in map_obj.room_cells()]
+        pairs = [(rng.choice(rooms)[1], rng.choice(rooms)[1]) for _ in range(args.queries)]
+        # A pair with no route is turned away before any search, so a high
+        # share would leave find_route timing little but that check.
+        components = map_obj.components()
+        unreachable = sum(1 for start, goal in pairs if not components.may_reach(start, goal)) / len(pairs)
+        operations = {
+            "find_route": measure_operation(lambda start, goal, map_obj=map_obj: map_obj.find_route(*start, *goal),
+                                            pairs, map_obj.search_engine()),
+            "get_room_coordinates": measure_operation(map_obj.get_room_coordinates,
+                                                      [(rng.choice(rooms)[0],) for _ in range(args.queries)]),
+            "print_map": measure_operation(map_obj.print_map, [()] * args.repeats),
+        }
+        result = {"floors": args.floors, "height": size, "width": size, "cells": map_obj.num_cells,
+                  "rooms": len(rooms), "unreachable_pairs": unreachable, "build_peak_bytes": build_peak,
+                  "operations": operations}
+        results.append(result)
+        print(f"{args.floors}x{size}x{size}, {len(rooms)} rooms, {unreachable:.0%} of pairs unreachable, "
+              f"build peak {build_peak / 1e6:.1f} MB")
+        for name, measured in operations.items():
+            expanded = f", {measured['expanded_mean']:.0f} expanded" if "expanded_mean" in measured else ""
+            print(f"  {name:21s} p50 {measured['p50_ms']:8.3f} ms  p99 {measured['p99_ms']:8.3f} ms  "
+                  f"peak {measured['peak_bytes'] / 1e6:7.2f} MB{expanded}")
+        del map_obj
+
+    report = {"created": time.time(), "python": platform.python_version(), "settings": vars(args),
+              "results": results}
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    if args.baseline:
+        compare_reports(args.baseline, report)
+
+
+def compare_reports(baseline_path, report):
+    # p50 latency against an earlier report, for the shapes both measured.
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    earlier = {(r["floors"], r["height"], r["width"]): r for r in baseline["results"]}
+    print(f"against {baseline_path}:")
+    for result in report["results"]:
+        before = earlier.get((result["floors"], result["height"], result["width"]))
+        if before is None:
+            continue
+        for name, measured in result["operations"].items():
+            if name in before["operations"] and before["operations"][name]["p50_ms"] > 0:
+                ratio = measured["p50_ms"] / before["operations"][name]["p50_ms"]
+                print(f"  {result['floors']}x{result['height']}x{result['width']} {name:21s} p50 {ratio:.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark route search on generated maps.")
+    parser.add_argument("--walls", type=float, default=0.25)
+    parser.add_argument("--stairs", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=1)
+    commands = parser.add_subparsers(dest="command")
+
+    compare_parser = commands.add_parser("compare", help="compare search implementations")
+    compare_parser.add_argument("--floors", type=int, default=3)
+    compare_parser.add_argument("--size", type=int, nargs="+", default=[11, 50, 100, 200])
+    compare_parser.add_argument("--queries", type=int, default=50)
+
+    scaling_parser = commands.add_parser("scaling", help="route latency and memory as maps grow")
+    scaling_parser.add_argument("--size", type=int, nargs="+", default=[100, 250, 500, 1000, 2000],
+                                help="floor heights to try on a single floor")
+    scaling_parser.add_argument("--floors", type=int, nargs="+", default=[1, 2, 4, 8],
+                                help="floor counts to try at --floor-size")
+    scaling_parser.add_argument("--floor-size", type=int, default=250)
+    scaling_parser.add_argument("--aspect", type=float, default=1.0, help="floor width as a multiple of height")
+    scaling_parser.add_argument("--queries", type=int, default=20)
+
+    suite_parser = commands.add_parser("suite", help="p50/p99, nodes expanded and memory on generated buildings")
+    suite_parser.add_argument("--floors", type=int, default=3)
+    suite_parser.add_argument("--size", type=int, nargs="+", default=[41, 101, 201])
+    suite_parser.add_argument("--spacing", type=int, default=6, help="cells between parallel corridors")
+    suite_parser.add_argument("--queries", type=int, default=200)
+    suite_parser.add_argument("--repeats", type=int, default=5, help="print_map calls per map")
+    suite_parser.add_argument("--output", default="benchmark.json")
+    suite_parser.add_argument("--baseline", help="an earlier --output to compare p50 against")
+
+    args = parser.parse_args()
+    if args.command == "scaling":
+        scaling(args)
+    elif args.command == "suite":
+        suite(args)
+    else:
+        if args.command is None:
+            args = parser.parse_args(sys.argv[1:] + ["compare"])
+        compare(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,296 @@
+import heapq
+import json
+import os
+import threading
+from collections import OrderedDict, namedtuple
+
+from connectors import PROFILES
+from facilities import UNREACHABLE, DistanceField
+from map_loader import MAP_RELOAD_INTERVAL, MAP_STORE_DIR, MapStore
+from map_model import Map
+from route_cache import RouteCache
+
+CAMPUS_FILE = os.environ.get("CAMPUS_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "maps", "campus.json"))
+CAMPUS_MEMORY_MB = float(os.environ.get("CAMPUS_MEMORY_MB", "256"))
+# What a loaded cell costs besides the routing tables: its slot in the
+# floor lists and the search engine's flat arrays, roughly.
+CELL_BYTES = 48
+
+# An outdoor path between two buildings, walked either way. Each end is
+# (building, floor, x, y); cost is in grid steps.
+CampusLink = namedtuple('CampusLink', 'source dest cost')
+
+
+def map_footprint(map_obj):
+    # Bytes a loaded building can come to, dominated by the trees its
+    # routing tables keep for each profile. Trees are grown as rooms are
+    # asked for, so this counts the most each table may hold rather than
+    # what it holds now, and stays the same for the whole map version.
+    size = map_obj.num_cells * CELL_BYTES
+    for profile in PROFILES:
+        size += map_obj.profile_table(profile).max_bytes()
+    return size
+
+
+def read_campus(path):
+    # {"buildings": {id: map file}, "links": [{"from": [id, floor, x, y],
+    # "to": [...], "cost": n}]}, map files relative to the campus file.
+    with open(path, encoding="utf-8") as f:
+        campus = json.load(f)
+    buildings = campus.get("buildings")
+    if not isinstance(buildings, dict) or not buildings:
+        raise ValueError("Campus has no buildings")
+    base = os.path.dirname(os.path.abspath(path))
+    paths = {building: os.path.join(base, map_file) for building, map_file in buildings.items()}
+    links = []
+    for link in campus.get("links", []):
+        source, dest = tuple(link.get("from", ())), tuple(link.get("to", ()))
+        if len(source) != 4 or len(dest) != 4:
+            raise ValueError("Campus link ends must be a building, floor, x and y")
+        if source[0] not in paths or dest[0] not in paths:
+            raise ValueError("Campus link names an unknown building")
+        cost = link.get("cost", 1)
+        if not isinstance(cost, int) or cost < 1:
+            raise ValueError("Campus link cost must be a positive whole number")
+        links.append(CampusLink(source, dest, cost))
+    return paths, links
+
+
+class CampusBuilding:
+    def __init__(self, building, path):
+        self.building = building
+        self.path = path
+        self.store = None
+        self.route_cache = None
+        self.pinned = False
+        # Routes searching through the building right now; it is not
+        # evicted while any are.
+        self.pins = 0
+        # Held while the building loads, so it is loaded once however many
+        # requests ask for it at the same time.
+        self.load_lock = threading.Lock()
+        # (map version, bytes) from map_footprint.
+        self._footprint = None
+        # Search trees towards this building's link ends, for routes that
+        # leave it: (map version, {cell: DistanceField}).
+        self._exit_fields = None
+
+    def footprint(self):
+        map_obj = self.store.current()
+        footprint = self._footprint
+        if footprint is None or footprint[0] != map_obj.version:
+            footprint = (map_obj.version, map_footprint(map_obj))
+            self._footprint = footprint
+        return footprint[1]
+
+    def exit_field(self, map_obj, cell):
+        fields = self._exit_fields
+        if fields is None or fields[0] != map_obj.version:
+            fields = (map_obj.version, {})
+            self._exit_fields = fields
+        field = fields[1].get(cell)
+        if field is None:
+            field = DistanceField(map_obj, 'campus link', [cell])
+            fields[1][cell] = field
+        return field
+
+
+class CampusRegistry:
+    def __init__(self, path, map_class=Map, memory_budget=CAMPUS_MEMORY_MB * 2 ** 20, pinned=(),
+                 poll_interval=MAP_RELOAD_INTERVAL, store_dir=MAP_STORE_DIR):
+        # Buildings are loaded the first time they are asked for and evicted,
+        # least recently used first, while the loaded ones would take more
+        # than the memory budget. A store passed in pinned serves the
+        # building with the same map file and is never evicted.
+        self.path = path
+        self.map_class = map_class
+        self.memory_budget = memory_budget
+        self.poll_interval = poll_interval
+        self.store_dir = store_dir
+        self.loads = 0
+        self.evictions = 0
+        self.buildings = {}
+        self.links = []
+        self._loaded = OrderedDict()
+        self._lock = threading.Lock()
+        if path is not None and os.path.exists(path):
+            paths, self.links = read_campus(path)
+            for building, map_path in paths.items():
+                self.buildings[building] = CampusBuilding(building, map_path)
+        for store, cache in pinned:
+            for entry in self.buildings.values():
+                if os.path.exists(entry.path) and os.path.samefile(entry.path, store.path):
+                    entry.store, entry.route_cache, entry.pinned = store, cache, True
+
+    def __contains__(self, building):
+        return building in self.buildings
+
+    def open(self, building, pin=False):
+        # The building's current map and route cache, loading it first if
+        # need be. Raises KeyError for an unknown building and ValueError
+        # when its map cannot be loaded. With pin the building stays loaded
+        # until unpin is called for it.
+        entry = self.buildings[building]
+        if entry.pinned:
+            return entry.store.current(), entry.route_cache
+        with self._lock:
+            if entry.store is not None:
+                return self._use(building, entry, pin)
+        # Reading a map and building its tables can take a while, so only
+        # requests for this building wait on it; the registry lock is taken
+        # again just to add it.
+        with entry.load_lock:
+            with self._lock:
+                if entry.store is not None:
+                    return self._use(building, entry, pin)
+            store = MapStore(entry.path, self.map_class, self.poll_interval, self.store_dir)
+            store.start()
+            with self._lock:
+                entry.store = store
+                entry.route_cache = RouteCache()
+                self.loads += 1
+                return self._use(building, entry, pin)
+
+    def _use(self, building, entry, pin=False):
+        self._loaded[building] = entry
+        self._loaded.move_to_end(building)
+        if pin:
+            entry.pins += 1
+        self._evict(keep=building)
+        return entry.store.current(), entry.route_cache
+
+    def unpin(self, building):
+        entry = self.buildings[building]
+        if entry.pinned:
+            return
+        with self._lock:
+            entry.pins -= 1
+            self._evict(keep=None)
+
+    def current(self, building):
+        return self.open(building)[0]
+
+    def _evict(self, keep):
+        used = sum(entry.footprint() for entry in self._loaded.values())
+        used += sum(entry.footprint() for entry in self.buildings.values() if entry.pinned)
+        for building in list(self._loaded):
+            if used <= self.memory_budget:
+                break
+            if building == keep or self._loaded[building].pins:
+                continue
+            entry = self._loaded.pop(building)
+            used -= entry.footprint()
+            entry.store.stop()
+            entry.store = entry.route_cache = entry._exit_fields = entry._footprint = None
+            self.evictions += 1
+
+    def stop(self):
+        with self._lock:
+            for entry in self._loaded.values():
+                entry.store.stop()
+
+    def status(self):
+        with self._lock:
+            loaded = {building: entry.footprint() for building, entry in self._loaded.items()}
+        for building, entry in self.buildings.items():
+            if entry.pinned:
+                loaded[building] = entry.footprint()
+        return {
+            "buildings": {building: {"path": entry.path, "pinned": entry.pinned,
+                                     "loaded": building in loaded,
+                                     "footprint": loaded.get(building)}
+                          for building, entry in self.buildings.items()},
+            "links": len(self.links),
+            "memory_budget": self.memory_budget,
+            "memory_used": sum(loaded.values()),
+            "loads": self.loads,
+            "evictions": self.evictions,
+        }
+
+    def route(self, start_building, start_room, end_building, end_room):
+        # Shortest walk between rooms in any two buildings, indoors and along
+        # the outdoor links. Dijkstra runs over the link ends only; the
+        # distances between them come from search trees inside each
+        # building, which is loaded only once the search reaches it.
+        # Returns (distance, legs) or None, where a leg is (building, route)
+        # indoors or (None, (from, to)) along a link.
+        # Each building is opened once and pinned for the whole search, so
+        # the legs are put together from the same maps they were priced on
+        # and the search cannot evict a building it still needs.
+        maps = {}
+
+        def open_map(building):
+            if building not in maps:
+                maps[building] = self.open(building, pin=True)[0]
+            return maps[building]
+
+        try:
+            return self._route(open_map, start_building, start_room, end_building, end_room)
+        finally:
+            for building in maps:
+                self.unpin(building)
+
+    def _route(self, open_map, start_building, start_room, end_building, end_room):
+        start_map = open_map(start_building)
+        start_cell = start_map.get_room_coordinates(start_room)
+        if start_cell is None:
+            raise ValueError("Start room not found")
+        end_room = open_map(end_building).resolve_room(end_room)
+        if end_room is None:
+            raise ValueError("End room not found")
+
+        exits = {}
+        for link in self.links:
+            for source, dest in ((link.source, link.dest), (link.dest, link.source)):
+                exits.setdefault(source[0], []).append((source, dest, link.cost))
+
+        start, goal = ('start',), ('goal',)
+        distance = {start: 0}
+        previous = {}
+        open_set = [(0, start)]
+        while open_set:
+            cost, node = heapq.heappop(open_set)
+            if node == goal:
+                break
+            if cost > distance[node]:
+                continue
+            building, cell = (start_building, start_cell) if node == start else (node[0], node[1:])
+            map_obj = open_map(building)
+            index = map_obj.cell_index(*cell)
+            steps = []
+            if building == end_building:
+                step = map_obj.routing_table().distance_from_cell(cell, end_room)
+                if step is not None:
+                    steps.append((goal, step, (building, cell, None)))
+            for source, dest, link_cost in exits.get(building, ()):
+                field = self.buildings[building].exit_field(map_obj, source[1:])
+                if field.distance[index] != UNREACHABLE:
+                    steps.append((source, field.distance[index], (building, cell, source[1:])))
+                if source == node:
+                    steps.append((dest, link_cost, (None, source, dest)))
+            for neighbor, step, leg in steps:
+                new_cost = cost + step
+                if neighbor not in distance or new_cost < distance[neighbor]:
+                    distance[neighbor] = new_cost
+                    previous[neighbor] = (node, leg)
+                    heapq.heappush(open_set, (new_cost, neighbor))
+
+        if goal not in distance:
+            return None
+        legs = []
+        node = goal
+        while node != start:
+            node, (building, cell, target) = previous[node]
+            if building is None:
+                legs.append((None, (cell, target)))
+                continue
+            map_obj = open_map(building)
+            if target is None:
+                route = map_obj.routing_table().route_from_cell(cell, end_room)
+            else:
+                route = self.buildings[building].exit_field(map_obj, target).route_from(*cell)
+            if legs and legs[-1][0] == building:
+                # Passing a link end without taking the link.
+                route = route + legs.pop()[1][1:]
+            legs.append((building, route))
+        return distance[goal], legs[::-1]
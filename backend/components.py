@@ -0,0 +1,62 @@
+from array import array
+from collections import deque
+
+NO_COMPONENT = -1
+
+
+class ConnectedComponents:
+    def __init__(self, map_obj):
+        engine = map_obj.search_engine()
+        self.engine = engine
+        self.version = map_obj.version
+        passable = engine.passable
+        stairs, stairs_into = engine.stairs, engine.stairs_into
+
+        # Every step can be walked back and connectors join both ways, so two
+        # open cells reach one another exactly when they share a component.
+        self.labels = array('i', [NO_COMPONENT]) * len(passable)
+        self.sizes = []
+        labels = self.labels
+        for root in range(len(passable)):
+            if not passable[root] or labels[root] != NO_COMPONENT:
+                continue
+            label = len(self.sizes)
+            labels[root] = label
+            size = 0
+            queue = deque([root])
+            while queue:
+                current = queue.popleft()
+                size += 1
+                candidates = engine.neighbors(current)
+                candidates.extend(stairs.get(current, ()))
+                candidates.extend(stairs_into.get(current, ()))
+                for neighbor in candidates:
+                    if passable[neighbor] and labels[neighbor] == NO_COMPONENT:
+                        labels[neighbor] = label
+                        queue.append(neighbor)
+            self.sizes.append(size)
+
+    @property
+    def count(self):
+        return len(self.sizes)
+
+    def component_of(self, floor, x, y):
+        label = self.labels[self.engine.cell_index(floor, x, y)]
+        return None if label == NO_COMPONENT else label
+
+    def may_reach(self, start, goal):
+        # False when no route can exist. A closed start cell may still be
+        # walked out of, into whatever is open around it.
+        engine = self.engine
+        start = engine.cell_index(*start)
+        goal = engine.cell_index(*goal)
+        if start == goal:
+            return True
+        goal_label = self.labels[goal]
+        if goal_label == NO_COMPONENT:
+            return False
+        if engine.passable[start]:
+            return self.labels[start] == goal_label
+        exits = engine.neighbors(start)
+        exits.extend(engine.stairs.get(start, ()))
+        return any(self.labels[cell] == goal_label for cell in exits)
@@ -0,0 +1,80 @@
+import heapq
+from array import array
+from collections import namedtuple
+
+from routing_table import UNREACHABLE, RoutingTable
+
+# A two-way link between floors. cost is what taking it is worth in grid
+# steps, including any waiting, for profiles that weigh connectors.
+Connector = namedtuple('Connector', 'kind source dest cost')
+
+CONNECTOR_KINDS = ('stairs', 'lift', 'ramp')
+DEFAULT_COSTS = {'stairs': 2, 'lift': 4, 'ramp': 3}
+PROFILES = ('default', 'step-free', 'fastest')
+
+
+def connector_cost(profile, connector):
+    # default counts every hop as one step, as routing always has;
+    # fastest uses each connector's own cost; step-free does the same but
+    # never takes stairs. None means the connector cannot be used.
+    if profile == 'default':
+        return 1
+    if profile == 'step-free' and connector.kind == 'stairs':
+        return None
+    return connector.cost
+
+
+class ProfileTable(RoutingTable):
+    # The routing table for one profile: next hops and distances towards
+    # every room, built with Dijkstra because connector costs vary.
+    def __init__(self, map_obj, profile):
+        if profile not in PROFILES:
+            raise ValueError("Unknown routing profile")
+        self.profile = profile
+        self._links_into = {}
+        for connector in map_obj.connectors:
+            cost = connector_cost(profile, connector)
+            if cost is None:
+                continue
+            for source, dest in ((connector.source, connector.dest), (connector.dest, connector.source)):
+                self._links_into.setdefault(map_obj.cell_index(*dest), []).append(
+                    (map_obj.cell_index(*source), cost))
+        super().__init__(map_obj)
+
+    def renew(self, map_obj):
+        table = ProfileTable(map_obj, self.profile)
+        table.max_trees = self.max_trees
+        return table
+
+    def _build_tree(self, root):
+        # Dijkstra backwards from the room over the search engine's arrays.
+        engine = self.map.search_engine()
+        passable = engine.passable
+        next_hop = array('i', [UNREACHABLE]) * len(passable)
+        distance = array('i', [UNREACHABLE]) * len(passable)
+        if not passable[root]:
+            return next_hop, distance
+
+        next_hop[root] = root
+        distance[root] = 0
+        open_set = [(0, root)]
+        while open_set:
+            cost, current = heapq.heappop(open_set)
+            if cost > distance[current]:
+                continue
+            candidates = [(neighbor, 1) for neighbor in engine.neighbors(current)]
+            candidates.extend(self._links_into.get(current, ()))
+            for neighbor, step in candidates:
+                if not passable[neighbor]:
+                    continue
+                new_cost = cost + step
+                if distance[neighbor] == UNREACHABLE or new_cost < distance[neighbor]:
+                    distance[neighbor] = new_cost
+                    next_hop[neighbor] = current
+                    heapq.heappush(open_set, (new_cost, neighbor))
+        self._leave_blocked(engine, next_hop, distance)
+        return next_hop, distance
+
+    def _links_from(self, engine, index):
+        # Links run both ways, so the ones into a cell also lead out of it.
+        return self._links_into.get(index, ())
@@ -0,0 +1,182 @@
+import heapq
+
+START = -1
+GOAL = -2
+
+
+class CorridorGraph:
+    def __init__(self, map_obj):
+        engine = map_obj.search_engine()
+        self.engine = engine
+        self.version = map_obj.version
+        passable = engine.passable
+
+        stair_cells = set(engine.stairs) | set(engine.stairs_into)
+        self._open_neighbors = {}
+        self.vertices = set()
+        for index, is_open in enumerate(passable):
+            if not is_open:
+                continue
+            neighbors = [n for n in engine.neighbors(index) if passable[n]]
+            self._open_neighbors[index] = neighbors
+            # Junctions, dead ends, rooms and stairs are kept; plain
+            # corridor cells with exactly two ways on are collapsed.
+            if len(neighbors) != 2 or index in stair_cells or map_obj.cell_value(*engine.cell_at(index)) != '.':
+                self.vertices.add(index)
+
+        # Each chain is the run of cells from one vertex to another, ends
+        # included. graph[v][w] = (cost, chain id, walks the chain forwards).
+        self.chains = []
+        self.graph = {vertex: {} for vertex in self.vertices}
+        self._chain_of = {}
+        for vertex in self.vertices:
+            for neighbor in self._open_neighbors[vertex]:
+                if neighbor not in self._chain_of:
+                    self._trace_chain(vertex, neighbor)
+        for source, dests in engine.stairs.items():
+            for dest in dests:
+                if passable[source] and passable[dest]:
+                    self.chains.append([source, dest])
+                    self._add_edge(source, dest, len(self.chains) - 1, True)
+
+    @property
+    def num_vertices(self):
+        return len(self.vertices)
+
+    @property
+    def num_edges(self):
+        return sum(len(edges) for edges in self.graph.values())
+
+    def _trace_chain(self, vertex, first):
+        cells = [vertex, first]
+        previous, current = vertex, first
+        while current not in self.vertices:
+            a, b = self._open_neighbors[current]
+            previous, current = current, (b if a == previous else a)
+            cells.append(current)
+
+        # Every corridor is stored once, even when a shorter one joins the
+        # same vertices, so any cell on it can be attached to the graph.
+        # Only the cheapest chain between two vertices becomes an edge.
+        chain_id = len(self.chains)
+        self.chains.append(cells)
+        for offset, cell in enumerate(cells[1:-1], start=1):
+            self._chain_of[cell] = (chain_id, offset)
+        if current != vertex:
+            self._add_edge(vertex, current, chain_id, True)
+            self._add_edge(current, vertex, chain_id, False)
+
+    def _add_edge(self, source, dest, chain_id, forwards):
+        cost = len(self.chains[chain_id]) - 1
+        existing = self.graph[source].get(dest)
+        if existing is None or cost < existing[0]:
+            self.graph[source][dest] = (cost, chain_id, forwards)
+
+    def _chain_cells(self, chain_id, forwards):
+        cells = self.chains[chain_id]
+        return cells if forwards else cells[::-1]
+
+    def _attach(self, index, towards_goal):
+        # Legs joining a cell to the graph: {vertex: (cost, cells)}, with
+        # cells running from the cell to the vertex, or the vertex to the
+        # cell when attaching a goal.
+        if index in self.vertices:
+            return {index: (0, [index])}
+        chain_id, offset = self._chain_of[index]
+        cells = self.chains[chain_id]
+        before = cells[:offset + 1][::-1]
+        after = cells[offset:]
+        legs = {}
+        for path in sorted((before, after), key=len, reverse=True):
+            legs[path[-1]] = (len(path) - 1, path[::-1] if towards_goal else path)
+        return legs
+
+    def find_route(self, start, goal):
+        engine = self.engine
+        start_index = engine.cell_index(*start)
+        goal_index = engine.cell_index(*goal)
+        if not self._attachable(start_index) or not self._attachable(goal_index):
+            # Cells on a closed loop with no junction never become part of
+            # the graph; fall back to the plain grid search for those.
+            return engine.find_route(start, goal)
+        path = self._search(start_index, goal_index)
+        if path is None:
+            return None
+        return [engine.cell_at(index) for index in path]
+
+    def _attachable(self, index):
+        return index in self.vertices or index in self._chain_of
+
+    def route_length(self, start, goal):
+        path = self.find_route(start, goal)
+        return None if path is None else len(path) - 1
+
+    def _search(self, start, goal):
+        engine = self.engine
+        if start == goal:
+            return [start]
+        if not engine.passable[goal]:
+            return None
+        start_legs = self._attach(start, towards_goal=False)
+        goal_legs = self._attach(goal, towards_goal=True)
+
+        bound = engine.landmark_bound(goal)
+        best = {START: 0}
+        came_from = {START: None}
+        closed = set()
+        open_set = [(0, START)]
+        direct = self._same_chain_path(start, goal)
+        if direct is not None:
+            best[GOAL] = len(direct) - 1
+            came_from[GOAL] = (START, direct)
+            heapq.heappush(open_set, (best[GOAL], GOAL))
+
+        while open_set:
+            _, current = heapq.heappop(open_set)
+            if current == GOAL:
+                break
+            if current in closed:
+                continue
+            closed.add(current)
+            cost = best[current]
+            if current == START:
+                edges = [(vertex, step, path) for vertex, (step, path) in start_legs.items()]
+            else:
+                edges = [(dest, step, (chain_id, forwards))
+                         for dest, (step, chain_id, forwards) in self.graph[current].items()]
+                if current in goal_legs:
+                    step, path = goal_legs[current]
+                    edges.append((GOAL, step, path))
+            for neighbor, step, leg in edges:
+                new_cost = cost + step
+                if new_cost < best.get(neighbor, new_cost + 1):
+                    estimate = 0 if neighbor == GOAL else bound(neighbor)
+                    if estimate is None:
+                        continue
+                    best[neighbor] = new_cost
+                    came_from[neighbor] = (current, leg)
+                    closed.discard(neighbor)
+                    heapq.heappush(open_set, (new_cost + estimate, neighbor))
+
+        if GOAL not in came_from:
+            return None
+        legs = []
+        node = GOAL
+        while came_from[node] is not None:
+            node, leg = came_from[node]
+            legs.append(leg)
+        path = [start]
+        for leg in reversed(legs):
+            if isinstance(leg, tuple):
+                leg = self._chain_cells(*leg)
+            path.extend(leg[1:])
+        return path
+
+    def _same_chain_path(self, start, goal):
+        start_chain = self._chain_of.get(start)
+        goal_chain = self._chain_of.get(goal)
+        if start_chain is None or goal_chain is None or start_chain[0] != goal_chain[0]:
+            return None
+        cells = self.chains[start_chain[0]]
+        a, b = start_chain[1], goal_chain[1]
+        return cells[a:b + 1] if a <= b else cells[b:a + 1][::-1]
@@ -0,0 +1,115 @@
+from array import array
+from collections import deque
+
+from route_encoding import DIRECTIONS
+
+UNREACHABLE = -1
+BUILT_IN_CATEGORIES = ('stairs', 'lifts', 'exits')
+CONNECTOR_CATEGORIES = {'stairs': 'stairs', 'lifts': 'lift'}
+
+
+def facility_cells(map_obj, category):
+    # Cells belonging to a category: both ends of every stair or lift
+    # connector, corridor cells on the outer edge of the ground floor (rooms
+    # on the edge are not ways out), or the cells of the rooms tagged with
+    # it in the map file.
+    if category in CONNECTOR_CATEGORIES:
+        kind = CONNECTOR_CATEGORIES[category]
+        cells = []
+        for connector in map_obj.connectors:
+            if connector.kind == kind:
+                cells.extend((connector.source, connector.dest))
+        return cells
+    if category == 'exits':
+        cells = []
+        floor_map = map_obj.print_floor(0) if map_obj.num_floors else None
+        for x, row in enumerate(floor_map or ()):
+            for y, cell in enumerate(row):
+                on_edge = x in (0, len(floor_map) - 1) or y in (0, len(row) - 1)
+                if on_edge and cell == '.':
+                    cells.append((0, x, y))
+        return cells
+    if category in map_obj.facilities:
+        cells = []
+        for room_name in map_obj.facilities[category]:
+            coords = map_obj.get_room_coordinates(room_name)
+            if coords is not None:
+                cells.append(coords)
+        return cells
+    raise ValueError("Unknown facility category")
+
+
+class DistanceField:
+    def __init__(self, map_obj, category, cells=None):
+        # One breadth-first search backwards from every facility at once.
+        # Each cell ends up with its distance to the nearest facility and
+        # the neighbour to step to, so any query is a walk down the field.
+        # Given cells, the field leads to those instead, such as the one
+        # cell of a destination room.
+        engine = map_obj.search_engine()
+        self.engine = engine
+        self.version = map_obj.version
+        self.category = category
+        self.floor_dims = map_obj.floor_dims
+        passable = engine.passable
+        stairs_into = engine.stairs_into
+
+        self.distance = array('i', [UNREACHABLE]) * len(passable)
+        self.next_hop = array('i', [UNREACHABLE]) * len(passable)
+        distance, next_hop = self.distance, self.next_hop
+        queue = deque()
+        for cell in cells if cells is not None else facility_cells(map_obj, category):
+            index = engine.cell_index(*cell)
+            if passable[index] and distance[index] == UNREACHABLE:
+                distance[index] = 0
+                next_hop[index] = index
+                queue.append(index)
+        self.sources = len(queue)
+
+        while queue:
+            current = queue.popleft()
+            candidates = engine.neighbors(current)
+            candidates.extend(stairs_into.get(current, ()))
+            for neighbor in candidates:
+                if passable[neighbor] and distance[neighbor] == UNREACHABLE:
+                    distance[neighbor] = distance[current] + 1
+                    next_hop[neighbor] = current
+                    queue.append(neighbor)
+
+    def route_from(self, floor, x, y):
+        # The route from a cell to its nearest facility, or None.
+        engine = self.engine
+        current = engine.cell_index(floor, x, y)
+        if self.distance[current] == UNREACHABLE:
+            return None
+        path = [engine.cell_at(current)]
+        while self.distance[current] != 0:
+            current = self.next_hop[current]
+            path.append(engine.cell_at(current))
+        return path
+
+    def directions(self, floor):
+        # One letter per cell for the next step towards the nearest
+        # facility: N, E, S or W, U or D for stairs up or down, L for a
+        # stair link on the same floor, * at the facility itself, and ''
+        # where there is no way there.
+        engine = self.engine
+        height, width = self.floor_dims[floor]
+        rows = []
+        for x in range(height):
+            row = []
+            for y in range(width):
+                index = engine.cell_index(floor, x, y)
+                step = self.next_hop[index]
+                if step == UNREACHABLE:
+                    row.append('')
+                elif step == index:
+                    row.append('*')
+                else:
+                    next_floor, next_x, next_y = engine.cell_at(step)
+                    if next_floor != floor:
+                        row.append('U' if next_floor > floor else 'D')
+                    else:
+                        row.append(DIRECTIONS.get((next_x - x, next_y - y), 'L'))
+            rows.append(row)
+        return rows
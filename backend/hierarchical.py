@@ -0,0 +1,225 @@
+import heapq
+from collections import deque
+
+CLUSTER_SIZE = 10
+MAX_ENTRANCE_WIDTH = 6
+START = -1
+GOAL = -2
+
+
+class HierarchicalPlanner:
+    def __init__(self, engine, cluster_size=CLUSTER_SIZE):
+        self.engine = engine
+        self.version = engine.version
+        self.cluster_size = cluster_size
+        # Abstract graph: portal and stair cells, keyed by flat cell index,
+        # with edge costs to the other abstract cells they can reach.
+        self.graph = {}
+        self.cluster_nodes = {}
+        self._refined = {}
+
+        self._add_entrances()
+        for source, dests in engine.stairs.items():
+            for dest in dests:
+                if engine.passable[source] and engine.passable[dest]:
+                    self._add_edge(source, dest, 1)
+        for cluster, nodes in self.cluster_nodes.items():
+            self._link_cluster(cluster, nodes)
+
+    def cluster_of(self, index):
+        floor, x, y = self.engine.cell_at(index)
+        return floor, x // self.cluster_size, y // self.cluster_size
+
+    def _add_node(self, index):
+        if index not in self.graph:
+            self.graph[index] = {}
+            self.cluster_nodes.setdefault(self.cluster_of(index), set()).add(index)
+
+    def _add_edge(self, source, dest, cost):
+        self._add_node(source)
+        self._add_node(dest)
+        if cost < self.graph[source].get(dest, cost + 1):
+            self.graph[source][dest] = cost
+
+    def _add_entrances(self):
+        # Walk every cluster border. Each run of cells that are open on both
+        # sides becomes one entrance (two, at its ends, if it is wide), and
+        # the cells either side of it become linked abstract nodes.
+        engine = self.engine
+        height, width = engine.height, engine.width
+        for floor in range(engine.num_floors):
+            for border in range(self.cluster_size, height, self.cluster_size):
+                self._add_border(
+                    [(engine.cell_index(floor, border - 1, i), engine.cell_index(floor, border, i)) for i in range(width)]
+                )
+            for border in range(self.cluster_size, width, self.cluster_size):
+                self._add_border(
+                    [(engine.cell_index(floor, i, border - 1), engine.cell_index(floor, i, border)) for i in range(height)]
+                )
+
+    def _add_border(self, pairs):
+        passable = self.engine.passable
+        run = []
+        for i, (inside, outside) in enumerate(pairs):
+            if i % self.cluster_size == 0:
+                self._add_entrance(run)
+                run = []
+            if passable[inside] and passable[outside]:
+                run.append((inside, outside))
+            else:
+                self._add_entrance(run)
+                run = []
+        self._add_entrance(run)
+
+    def _add_entrance(self, run):
+        if not run:
+            return
+        if len(run) > MAX_ENTRANCE_WIDTH:
+            chosen = [run[0], run[-1]]
+        else:
+            chosen = [run[len(run) // 2]]
+        for inside, outside in chosen:
+            self._add_edge(inside, outside, 1)
+            self._add_edge(outside, inside, 1)
+
+    def _link_cluster(self, cluster, nodes):
+        for node in nodes:
+            distance, _ = self._cluster_search(node, cluster)
+            for other in nodes:
+                if other != node and other in distance:
+                    self._add_edge(node, other, distance[other])
+
+    def _cluster_search(self, source, cluster, target=None):
+        # Breadth-first search that never leaves the given cluster.
+        engine = self.engine
+        passable = engine.passable
+        floor, cluster_x, cluster_y = cluster
+        low_x, low_y = cluster_x * self.cluster_size, cluster_y * self.cluster_size
+        high_x = min(low_x + self.cluster_size, engine.height)
+        high_y = min(low_y + self.cluster_size, engine.width)
+
+        distance = {source: 0}
+        came_from = {source: None}
+        queue = deque([source])
+        while queue:
+            current = queue.popleft()
+            if current == target:
+                break
+            _, x, y = engine.cell_at(current)
+            for new_x, new_y in ((x + 1, y), (x - 1, y), (x, y - 1), (x, y + 1)):
+                if low_x <= new_x < high_x and low_y <= new_y < high_y:
+                    neighbor = engine.cell_index(floor, new_x, new_y)
+                    if passable[neighbor] and neighbor not in distance:
+                        distance[neighbor] = distance[current] + 1
+                        came_from[neighbor] = current
+                        queue.append(neighbor)
+        return distance, came_from
+
+    def _cluster_path(self, source, target):
+        key = (source, target)
+        path = self._refined.get(key)
+        if path is None:
+            _, came_from = self._cluster_search(source, self.cluster_of(source), target)
+            if target not in came_from:
+                return None
+            path = [target]
+            while came_from[path[-1]] is not None:
+                path.append(came_from[path[-1]])
+            path.reverse()
+            if source in self.graph and target in self.graph:
+                self._refined[key] = path
+        return path
+
+    def find_route(self, start, goal):
+        engine = self.engine
+        start = engine.cell_index(*start)
+        goal = engine.cell_index(*goal)
+        if start == goal:
+            return [engine.cell_at(start)]
+        if not engine.passable[goal]:
+            return None
+
+        start_cluster = self.cluster_of(start)
+        goal_cluster = self.cluster_of(goal)
+        start_distance, _ = self._cluster_search(start, start_cluster)
+        goal_distance, _ = self._cluster_search(goal, goal_cluster)
+
+        # A* over the abstract graph with the start and goal spliced in
+        # through their own clusters' portals. The start's own steps out of
+        # its cluster and its stair links are spliced in too, as a closed
+        # start cell can still be left and has no abstract edges of its
+        # own; a cell they lead to that is not in the graph is spliced the
+        # same way. Abstract edges are real path lengths, so the engine's
+        # landmark bounds stay admissible here.
+        bound = engine.landmark_bound(goal)
+        best = {START: 0}
+        came_from = {START: None}
+        closed = set()
+        open_set = [(0, START)]
+        if start_cluster == goal_cluster and goal in start_distance:
+            best[GOAL] = start_distance[goal]
+            came_from[GOAL] = START
+            heapq.heappush(open_set, (best[GOAL], GOAL))
+
+        while open_set:
+            _, current = heapq.heappop(open_set)
+            if current == GOAL:
+                break
+            cost = best[current]
+            if current in closed:
+                continue
+            closed.add(current)
+            if current == START:
+                edges = [(node, start_distance[node])
+                         for node in self.cluster_nodes.get(start_cluster, ()) if node in start_distance]
+                edges.extend((GOAL if link == goal else link, 1) for link in self._links_out(start))
+            else:
+                if current in self.graph:
+                    edges = list(self.graph[current].items())
+                else:
+                    cluster = self.cluster_of(current)
+                    distance, _ = self._cluster_search(current, cluster)
+                    edges = [(node, distance[node])
+                             for node in self.cluster_nodes.get(cluster, ()) if node in distance]
+                if current in goal_distance and self.cluster_of(current) == goal_cluster:
+                    edges.append((GOAL, goal_distance[current]))
+            for neighbor, step in edges:
+                new_cost = cost + step
+                if new_cost < best.get(neighbor, new_cost + 1):
+                    estimate = 0 if neighbor == GOAL else bound(neighbor)
+                    if estimate is None:
+                        continue
+                    best[neighbor] = new_cost
+                    came_from[neighbor] = current
+                    closed.discard(neighbor)
+                    heapq.heappush(open_set, (new_cost + estimate, neighbor))
+
+        if GOAL not in came_from:
+            return None
+        waypoints = [GOAL]
+        while came_from[waypoints[-1]] is not None:
+            waypoints.append(came_from[waypoints[-1]])
+        waypoints.reverse()
+        waypoints[0], waypoints[-1] = start, goal
+        return [engine.cell_at(index) for index in self._refine(waypoints)]
+
+    def _links_out(self, index):
+        # Open cells one step from index that its cluster search cannot
+        # reach: the neighbours across a cluster border and stair links.
+        engine = self.engine
+        cluster = self.cluster_of(index)
+        links = [neighbor for neighbor in engine.neighbors(index) if self.cluster_of(neighbor) != cluster]
+        links.extend(engine.stairs.get(index, ()))
+        return [link for link in links if engine.passable[link]]
+
+    def _refine(self, waypoints):
+        path = [waypoints[0]]
+        stairs = self.engine.stairs
+        for source, target in zip(waypoints, waypoints[1:]):
+            if self.cluster_of(source) != self.cluster_of(target) or target in stairs.get(source, ()):
+                # Portal crossings and stair links are single steps, even a
+                # link whose two ends fall in the same cluster.
+                path.append(target)
+            else:
+                path.extend(self._cluster_path(source, target)[1:])
+        return path
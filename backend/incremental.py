@@ -0,0 +1,238 @@
+import heapq
+import math
+import os
+import threading
+import uuid
+from collections import OrderedDict
+
+MAX_SESSIONS = int(os.environ.get("MAX_SESSIONS", "1000"))
+INFINITY = math.inf
+
+
+class IncrementalPlanner:
+    # D* Lite from one position to one goal on a live map. The search runs
+    # backwards from the goal, so when cells open or close only the costs
+    # around the change are repaired, and the user moving along the route
+    # only shifts the heuristic instead of starting over.
+    def __init__(self, map_obj, start, goal):
+        engine = map_obj.search_engine()
+        self.map_obj = map_obj
+        self.height = engine.height
+        self.width = engine.width
+        self.floor_cells = engine.floor_cells
+        self.passable = bytearray(engine.passable)
+        self.stairs = engine.stairs
+        self.stairs_into = engine.stairs_into
+        self.neighbors = engine.neighbors
+        # Stair links may also move across the floor plan; the heuristic
+        # stays admissible by allowing for the longest such jump.
+        self.max_stair_shift = max(
+            (self._plan_distance(source, dest) for source, dests in self.stairs.items() for dest in dests), default=0
+        )
+
+        self.start = engine.cell_index(*start)
+        self.goal = engine.cell_index(*goal)
+        self.version = map_obj.version
+        self.key_offset = 0
+        self.expanded = 0
+        self.g_score = {}
+        self.rhs = {self.goal: 0}
+        self._queued = {}
+        self._open_set = []
+        self._push(self.goal)
+        self._compute_shortest_path()
+
+    def cell_index(self, floor, x, y):
+        return (floor * self.height + x) * self.width + y
+
+    def cell_at(self, index):
+        floor, rest = divmod(index, self.floor_cells)
+        x, y = divmod(rest, self.width)
+        return floor, x, y
+
+    def _plan_distance(self, a, b):
+        ax, ay = divmod(a % self.floor_cells, self.width)
+        bx, by = divmod(b % self.floor_cells, self.width)
+        return abs(ax - bx) + abs(ay - by)
+
+    def _heuristic(self, a, b):
+        distance = self._plan_distance(a, b)
+        other_floor = a // self.floor_cells != b // self.floor_cells
+        if self.max_stair_shift == 0:
+            return distance + other_floor
+        return max(other_floor, -(-distance // self.max_stair_shift))
+
+    def _successors(self, index):
+        return self.neighbors(index) + self.stairs.get(index, [])
+
+    def _predecessors(self, index):
+        return self.neighbors(index) + self.stairs_into.get(index, [])
+
+    def _key(self, index):
+        best = min(self.g_score.get(index, INFINITY), self.rhs.get(index, INFINITY))
+        return best + self._heuristic(self.start, index) + self.key_offset, best
+
+    def _push(self, index):
+        key = self._key(index)
+        self._queued[index] = key
+        heapq.heappush(self._open_set, (key, index))
+
+    def _top_key(self):
+        # Entries are removed lazily: anything whose key no longer matches
+        # the one recorded for its cell is stale.
+        open_set = self._open_set
+        while open_set and self._queued.get(open_set[0][1]) != open_set[0][0]:
+            heapq.heappop(open_set)
+        return open_set[0][0] if open_set else (INFINITY, INFINITY)
+
+    def _update_vertex(self, index):
+        if index != self.goal:
+            best = INFINITY
+            g_score = self.g_score
+            passable = self.passable
+            for neighbor in self._successors(index):
+                if passable[neighbor]:
+                    cost = g_score.get(neighbor, INFINITY) + 1
+                    if cost < best:
+                        best = cost
+            self.rhs[index] = best
+        self._queued.pop(index, None)
+        if self.g_score.get(index, INFINITY) != self.rhs.get(index, INFINITY):
+            self._push(index)
+
+    def _compute_shortest_path(self):
+        start = self.start
+        g_score = self.g_score
+        rhs = self.rhs
+        while (self._top_key() < self._key(start)
+               or rhs.get(start, INFINITY) != g_score.get(start, INFINITY)):
+            if not self._open_set:
+                break
+            old_key, current = heapq.heappop(self._open_set)
+            del self._queued[current]
+            self.expanded += 1
+            new_key = self._key(current)
+            if old_key < new_key:
+                self._push(current)
+            elif g_score.get(current, INFINITY) > rhs.get(current, INFINITY):
+                g_score[current] = rhs[current]
+                # Only open cells can be stepped onto; a closed one has no
+                # way in, so nothing upstream depends on it.
+                if self.passable[current] or current == self.goal:
+                    for neighbor in self._predecessors(current):
+                        self._update_vertex(neighbor)
+            else:
+                g_score[current] = INFINITY
+                self._update_vertex(current)
+                for neighbor in self._predecessors(current):
+                    self._update_vertex(neighbor)
+
+    def route(self):
+        if self.g_score.get(self.start, INFINITY) == INFINITY:
+            return None
+        path = [self.start]
+        current = self.start
+        g_score = self.g_score
+        while current != self.goal and len(path) <= len(self.passable):
+            best = INFINITY
+            for neighbor in self._successors(current):
+                if self.passable[neighbor] and g_score.get(neighbor, INFINITY) < best:
+                    best = g_score[neighbor]
+                    current = neighbor
+            if best == INFINITY:
+                return None
+            path.append(current)
+        return [self.cell_at(index) for index in path]
+
+    def move_to(self, floor, x, y):
+        start = self.cell_index(floor, x, y)
+        self.key_offset += self._heuristic(self.start, start)
+        self.start = start
+        self._compute_shortest_path()
+
+    def update_cells(self, cells):
+        # A cell opening or closing changes the cost of every edge into it,
+        # so each cell that can step onto it gets its estimate refreshed.
+        changed = False
+        for floor, x, y in cells:
+            index = self.cell_index(floor, x, y)
+            is_open = 1 if self.map_obj.is_open(floor, x, y) else 0
+            if self.passable[index] == is_open:
+                continue
+            self.passable[index] = is_open
+            changed = True
+            for neighbor in self._predecessors(index):
+                self._update_vertex(neighbor)
+        self.version = self.map_obj.version
+        if changed:
+            self._compute_shortest_path()
+        return changed
+
+
+class NavigationSessions:
+    def __init__(self, max_sessions=MAX_SESSIONS):
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self, map_obj, start, goal_room):
+        goal = map_obj.get_room_coordinates(goal_room)
+        planner = IncrementalPlanner(map_obj, start, goal)
+        with self._lock:
+            session_id = uuid.uuid4().hex
+            self._sessions[session_id] = (planner, goal_room)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+            return session_id, planner.route()
+
+    def _planner(self, session_id, map_obj):
+        planner, goal_room = self._sessions[session_id]
+        self._sessions.move_to_end(session_id)
+        if planner.map_obj is not map_obj and planner.map_obj.layout_version == map_obj.layout_version:
+            # Only cells have closed or opened since, as when another worker
+            # changed them: repair the plan.
+            cells = planner.map_obj.blocked.keys() ^ map_obj.blocked.keys()
+            planner.map_obj = map_obj
+            planner.update_cells(cells)
+        elif planner.map_obj is not map_obj:
+            # The map was reloaded from its file: plan again on the new one,
+            # from where the user was, if both ends still exist there.
+            start = planner.cell_at(planner.start)
+            goal = map_obj.get_room_coordinates(goal_room)
+            if goal is None or not map_obj.in_bounds(*start):
+                del self._sessions[session_id]
+                raise KeyError(session_id)
+            planner = IncrementalPlanner(map_obj, start, goal)
+            self._sessions[session_id] = (planner, goal_room)
+        return planner
+
+    def route(self, session_id, map_obj):
+        with self._lock:
+            return self._planner(session_id, map_obj).route()
+
+    def move(self, session_id, map_obj, floor, x, y):
+        with self._lock:
+            planner = self._planner(session_id, map_obj)
+            planner.move_to(floor, x, y)
+            return planner.route()
+
+    def remove(self, session_id):
+        with self._lock:
+            del self._sessions[session_id]
+
+    def cells_changed(self, old_map, map_obj, cells):
+        # Move every session planning on the map the change replaced onto
+        # the new one and repair it there straight away, so the next poll
+        # from any of them is already up to date.
+        updated = 0
+        with self._lock:
+            for planner, _ in self._sessions.values():
+                if planner.map_obj is not old_map:
+                    continue
+                planner.map_obj = map_obj
+                if planner.update_cells(cells):
+                    updated += 1
+        return updated
+
+    def __len__(self):
+        return len(self._sessions)
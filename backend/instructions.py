@@ -0,0 +1,78 @@
+from route_encoding import STEPS, encode_runs
+
+HEADINGS = ('N', 'E', 'S', 'W')
+HEADING_NAMES = {'N': "north", 'E': "east", 'S': "south", 'W': "west"}
+TURNS = {1: "right", 2: "around", 3: "left"}
+
+
+def _cells(count):
+    return "1 cell" if count == 1 else f"{count} cells"
+
+
+class RouteInstructions:
+    def __init__(self, map_obj):
+        self.version = map_obj.version
+        # Everything that depends only on the map is worked out once per
+        # version: the text for arriving at each room, and the room beside
+        # each open cell, used to name the places where turns happen.
+        self.rooms = {}
+        self.arrivals = {}
+        self.landmarks = {}
+        self.link_kinds = {}
+        for connector in map_obj.connectors:
+            self.link_kinds.setdefault((connector.source, connector.dest), connector.kind)
+            self.link_kinds.setdefault((connector.dest, connector.source), connector.kind)
+        for room_name, (floor, x, y) in map_obj.room_cells():
+            self.rooms[(floor, x, y)] = room_name
+            self.arrivals[room_name] = f"Arrive at {room_name} on floor {floor}"
+            for new_x, new_y in ((x + 1, y), (x - 1, y), (x, y - 1), (x, y + 1)):
+                if map_obj.in_bounds(floor, new_x, new_y) and map_obj.is_open(floor, new_x, new_y):
+                    self.landmarks.setdefault((floor, new_x, new_y), room_name)
+
+    def describe(self, route, end_room=None):
+        # Turns a route into start, straight, turn, connector (stairs, lift
+        # or ramp) and arrive steps.
+        if not route:
+            return []
+        floor, x, y = route[0]
+        start_room = self.rooms.get((floor, x, y))
+        where = start_room if start_room is not None else f"({x}, {y})"
+        steps = [{"type": "start", "floor": floor, "x": x, "y": y, "text": f"Start at {where} on floor {floor}"}]
+
+        heading = None
+        for step in encode_runs(route)["steps"]:
+            if step[0] == "stairs":
+                kind = self.link_kinds.get(((floor, x, y), tuple(step[1:])), "stairs")
+                _, floor, x, y = step
+                text = f"Take the {kind} at ({x}, {y}) to floor {floor}"
+                previous = steps[-1]
+                if previous["type"] == kind and (previous["x"], previous["y"]) == (x, y):
+                    # Several flights in one stairwell, or several floors in
+                    # one lift, read as one step.
+                    previous["floor"] = floor
+                    previous["text"] = text
+                else:
+                    steps.append({"type": kind, "floor": floor, "x": x, "y": y, "text": text})
+                heading = None
+                continue
+
+            direction, count = step
+            if heading is not None and direction != heading:
+                turn = TURNS[(HEADINGS.index(direction) - HEADINGS.index(heading)) % 4]
+                landmark = self.landmarks.get((floor, x, y))
+                text = "Turn around" if turn == "around" else f"Turn {turn}"
+                if landmark is not None and landmark not in (start_room, end_room):
+                    text += f" at {landmark}"
+                steps.append({"type": "turn", "turn": turn, "text": text})
+            verb = "Head" if heading is None else "Go"
+            steps.append({"type": "straight", "direction": HEADING_NAMES[direction], "cells": count,
+                          "text": f"{verb} {HEADING_NAMES[direction]} for {_cells(count)}"})
+            heading = direction
+            dx, dy = STEPS[direction]
+            x, y = x + dx * count, y + dy * count
+
+        if end_room is None:
+            end_room = self.rooms.get((floor, x, y))
+        text = self.arrivals.get(end_room, "Arrive at your destination")
+        steps.append({"type": "arrive", "room": end_room, "floor": floor, "x": x, "y": y, "text": text})
+        return steps
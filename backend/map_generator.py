@@ -0,0 +1,124 @@
+import argparse
+import json
+import random
+from collections import deque
+
+from map_loader import encode_binary
+
+
+def generate_layout(num_floors=3, height=41, width=None, corridor_spacing=6, wall_density=0.1, num_stairs=2,
+                    seed=0):
+    # A seeded building in the map file layout: on every floor, corridors
+    # run the full length and width every corridor_spacing cells, rooms
+    # open onto them from the walls in between, and up to wall_density of
+    # the corridor cells between crossings are blocked, so long as every
+    # room can still be reached. Stairs join random corridor crossings on
+    # neighbouring floors.
+    rng = random.Random(seed)
+    width = width or height
+    if corridor_spacing < 3:
+        raise ValueError("Corridors must be at least three cells apart")
+    offset = corridor_spacing // 2
+    corridor_rows = range(offset, height, corridor_spacing)
+    corridor_columns = range(offset, width, corridor_spacing)
+    crossings = [(x, y) for x in corridor_rows for y in corridor_columns]
+    if not crossings:
+        raise ValueError("Map is too small for a corridor")
+
+    floors = []
+    for floor in range(num_floors):
+        floor_map = [['X'] * width for _ in range(height)]
+        for x in corridor_rows:
+            floor_map[x] = ['.'] * width
+        for y in corridor_columns:
+            for x in range(height):
+                floor_map[x][y] = '.'
+        # A blocked cell closes the stretch of corridor between the two
+        # crossings it lies on. Each stretch is blocked at most once, so
+        # both halves still lead to a crossing, and only while the
+        # crossings left joined all reach one another. Stretches running
+        # out past the last crossing to the edge are never blocked.
+        joined = {crossing: set() for crossing in crossings}
+        for x, y in crossings:
+            for neighbor in ((x + corridor_spacing, y), (x, y + corridor_spacing)):
+                if neighbor in joined:
+                    joined[(x, y)].add(neighbor)
+                    joined[neighbor].add((x, y))
+        for x in range(height):
+            for y in range(width):
+                crossing = (x - offset) % corridor_spacing == 0 and (y - offset) % corridor_spacing == 0
+                if floor_map[x][y] != '.' or crossing or rng.random() >= wall_density:
+                    continue
+                if (x - offset) % corridor_spacing == 0:
+                    low = y - (y - offset) % corridor_spacing
+                    ends = ((x, low), (x, low + corridor_spacing))
+                else:
+                    low = x - (x - offset) % corridor_spacing
+                    ends = ((low, y), (low + corridor_spacing, y))
+                if ends[1] in joined.get(ends[0], ()) and _still_joined(joined, *ends):
+                    floor_map[x][y] = 'X'
+
+        # Doors every other cell along each corridor, on either side.
+        rooms = 0
+        for x in range(height):
+            for y in range(width):
+                on_corridor = (x - offset) % corridor_spacing == 0 or (y - offset) % corridor_spacing == 0
+                if floor_map[x][y] != 'X' or on_corridor or (x + y) % 2:
+                    continue
+                beside = [(x + dx, y + dy) for dx, dy in ((1, 0), (-1, 0), (0, 1), (0, -1))
+                          if 0 <= x + dx < height and 0 <= y + dy < width]
+                if any(floor_map[a][b] == '.' for a, b in beside):
+                    rooms += 1
+                    floor_map[x][y] = f"F{floor}R{rooms}"
+        floors.append(floor_map)
+
+    stairs = []
+    for floor in range(num_floors - 1):
+        for x, y in rng.sample(crossings, min(num_stairs, len(crossings))):
+            stairs.append([floor, x, y, floor + 1, x, y])
+    return {"floors": floors, "stairs": stairs, "aliases": {}, "entrance": [0, offset, 0]}
+
+
+def _still_joined(joined, a, b):
+    # Drops the stretch between crossings a and b if a can still reach b
+    # some other way, and says whether it did.
+    joined[a].discard(b)
+    joined[b].discard(a)
+    seen = {a}
+    queue = deque([a])
+    while queue:
+        for neighbor in joined[queue.popleft()]:
+            if neighbor == b:
+                return True
+            if neighbor not in seen:
+                seen.add(neighbor)
+                queue.append(neighbor)
+    joined[a].add(b)
+    joined[b].add(a)
+    return False
+
+
+def main():
+    # python map_generator.py --floors 4 --size 201 maps/generated.json
+    parser = argparse.ArgumentParser(description="Write a generated building map.")
+    parser.add_argument("--floors", type=int, default=3)
+    parser.add_argument("--size", type=int, default=41, help="floor height")
+    parser.add_argument("--width", type=int, default=None, help="floor width, the height if not given")
+    parser.add_argument("--spacing", type=int, default=6, help="cells between parallel corridors")
+    parser.add_argument("--walls", type=float, default=0.1,
+                        help="share of corridor cells blocked, where every room stays reachable")
+    parser.add_argument("--stairs", type=int, default=2, help="stairs between each pair of floors")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("dest", help="a .json or .bin map file")
+    args = parser.parse_args()
+    layout = generate_layout(args.floors, args.size, args.width, args.spacing, args.walls, args.stairs, args.seed)
+    if args.dest.endswith(".bin"):
+        with open(args.dest, "wb") as f:
+            f.write(encode_binary(layout))
+    else:
+        with open(args.dest, "w", encoding="utf-8") as f:
+            json.dump(layout, f)
+
+
+if __name__ == "__main__":
+    main()
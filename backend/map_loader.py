@@ -0,0 +1,410 @@
+import json
+import os
+import struct
+import sys
+import threading
+import time
+from array import array
+
+from connectors import CONNECTOR_KINDS, PROFILES
+from facilities import BUILT_IN_CATEGORIES
+from map_model import Map
+from shared_store import load_routing_table, read_blocked, update_blocked
+
+MAP_FILE = os.environ.get("MAP_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "maps", "building.json"))
+MAP_STORE_DIR = os.environ.get("MAP_STORE_DIR", os.path.join(os.path.dirname(MAP_FILE), "compiled"))
+MAP_RELOAD_INTERVAL = float(os.environ.get("MAP_RELOAD_INTERVAL", "2"))
+
+# Binary layout, all little-endian:
+#   header   magic, format version, floor count, name count
+#   names    per name: byte length (uint16) then UTF-8 bytes
+#   floors   per floor: height, width (uint16), then height * width
+#            uint16 indexes into the name table, row by row
+#   stairs   link count (uint32), then six int32 per link
+#   aliases  alias count (uint16), then alias and room name strings
+#   entrance one byte, 1 if present, then floor, x, y as int32 (version 2)
+#   connectors  count (uint32), then per connector its kind as an index
+#            into CONNECTOR_KINDS (uint8), six int32 coordinates and its
+#            cost as int32, 0 for the kind's default (version 3)
+#   facilities  category count (uint16), then per category its name, a
+#            room count (uint16) and the room names (version 4)
+MAGIC = b"NAVM"
+FORMAT_VERSION = 4
+CONNECTOR = struct.Struct("<B7i")
+HEADER = struct.Struct("<4sHHH")
+UINT16 = struct.Struct("<H")
+UINT32 = struct.Struct("<I")
+
+
+def read_layout(path):
+    if path.endswith(".bin"):
+        with open(path, "rb") as f:
+            return decode_binary(f.read())
+    with open(path, encoding="utf-8") as f:
+        layout = json.load(f)
+    check_layout(layout)
+    return layout
+
+
+def check_layout(layout):
+    if not isinstance(layout, dict):
+        raise ValueError("Map file must hold a JSON object")
+    floors = layout.get("floors")
+    if not isinstance(floors, list) or not floors:
+        raise ValueError("Map has no floors")
+    for floor_map in floors:
+        if not isinstance(floor_map, list) or not all(isinstance(row, list) for row in floor_map):
+            raise ValueError("Floor must be a list of rows")
+    for link in layout.get("stairs", []):
+        if len(link) != 6:
+            raise ValueError("Stair link must have six coordinates")
+    for connector in layout.get("connectors", []):
+        if not isinstance(connector, dict) or connector.get("kind") not in CONNECTOR_KINDS:
+            raise ValueError("Connector needs a kind, one of " + ", ".join(CONNECTOR_KINDS))
+        if len(connector.get("from", ())) != 3 or len(connector.get("to", ())) != 3:
+            raise ValueError("Connector ends must have three coordinates")
+        cost = connector.get("cost")
+        if cost is not None and (not isinstance(cost, int) or cost < 1):
+            raise ValueError("Connector cost must be a positive whole number")
+
+
+def build_map(layout, map_class=Map):
+    map_obj = map_class(layout["floors"])
+    for link in layout.get("stairs", []):
+        map_obj.add_stairs(*link)
+    for connector in layout.get("connectors", []):
+        map_obj.add_connector(connector["kind"], *connector["from"], *connector["to"], cost=connector.get("cost"))
+    for alias, room_name in layout.get("aliases", {}).items():
+        map_obj.add_alias(alias, room_name)
+    if layout.get("entrance") is not None:
+        entrance = tuple(layout["entrance"])
+        if len(entrance) != 3 or not map_obj.in_bounds(*entrance):
+            raise ValueError("Invalid entrance position")
+        map_obj.entrance = entrance
+    for category, room_names in layout.get("facilities", {}).items():
+        if category in BUILT_IN_CATEGORIES:
+            raise ValueError(f"Facility category {category} is built in")
+        for room_name in room_names:
+            if map_obj.resolve_room(room_name) is None:
+                raise ValueError(f"Unknown room in facility {category}: {room_name}")
+        map_obj.facilities[category] = list(room_names)
+    return map_obj
+
+
+def _write_string(out, text):
+    data = text.encode("utf-8")
+    out += UINT16.pack(len(data))
+    out += data
+
+
+def _read_string(data, offset):
+    (length,) = UINT16.unpack_from(data, offset)
+    offset += UINT16.size
+    return data[offset:offset + length].decode("utf-8"), offset + length
+
+
+def encode_binary(layout):
+    check_layout(layout)
+    floors = layout["floors"]
+    names = {}
+    for floor_map in floors:
+        for row in floor_map:
+            for cell in row:
+                names.setdefault(cell, len(names))
+    if len(names) > 0xFFFF:
+        raise ValueError("Too many distinct cell names")
+
+    out = bytearray(HEADER.pack(MAGIC, FORMAT_VERSION, len(floors), len(names)))
+    for name in names:
+        _write_string(out, name)
+    for floor_map in floors:
+        height = len(floor_map)
+        width = len(floor_map[0]) if floor_map else 0
+        if any(len(row) != width for row in floor_map):
+            raise ValueError("Binary maps need rectangular floors")
+        out += struct.pack("<HH", height, width)
+        codes = array("H", (names[cell] for row in floor_map for cell in row))
+        if sys.byteorder != "little":
+            codes.byteswap()
+        out += codes.tobytes()
+
+    stairs = layout.get("stairs", [])
+    out += UINT32.pack(len(stairs))
+    out += struct.pack(f"<{6 * len(stairs)}i", *(value for link in stairs for value in link))
+    aliases = layout.get("aliases", {})
+    out += UINT16.pack(len(aliases))
+    for alias, room_name in aliases.items():
+        _write_string(out, alias)
+        _write_string(out, room_name)
+    entrance = layout.get("entrance")
+    out += struct.pack("<B", entrance is not None)
+    if entrance is not None:
+        out += struct.pack("<3i", *entrance)
+    connectors = layout.get("connectors", [])
+    out += UINT32.pack(len(connectors))
+    for connector in connectors:
+        out += CONNECTOR.pack(CONNECTOR_KINDS.index(connector["kind"]), *connector["from"], *connector["to"],
+                              connector.get("cost") or 0)
+    facilities = layout.get("facilities", {})
+    out += UINT16.pack(len(facilities))
+    for category, room_names in facilities.items():
+        _write_string(out, category)
+        out += UINT16.pack(len(room_names))
+        for room_name in room_names:
+            _write_string(out, room_name)
+    return bytes(out)
+
+
+def decode_binary(data):
+    try:
+        magic, format_version, num_floors, num_names = HEADER.unpack_from(data, 0)
+        if magic != MAGIC or format_version not in (1, 2, 3, FORMAT_VERSION):
+            raise ValueError("Not a binary map file")
+        offset = HEADER.size
+        names = []
+        for _ in range(num_names):
+            name, offset = _read_string(data, offset)
+            names.append(name)
+
+        floors = []
+        for _ in range(num_floors):
+            height, width = struct.unpack_from("<HH", data, offset)
+            offset += 4
+            codes = array("H")
+            codes.frombytes(data[offset:offset + 2 * height * width])
+            if len(codes) != height * width:
+                raise ValueError("Binary map file is truncated")
+            if sys.byteorder != "little":
+                codes.byteswap()
+            offset += 2 * height * width
+            floors.append([[names[code] for code in codes[x * width:(x + 1) * width]] for x in range(height)])
+
+        (num_stairs,) = UINT32.unpack_from(data, offset)
+        offset += UINT32.size
+        values = struct.unpack_from(f"<{6 * num_stairs}i", data, offset)
+        offset += 24 * num_stairs
+        stairs = [list(values[i:i + 6]) for i in range(0, len(values), 6)]
+
+        (num_aliases,) = UINT16.unpack_from(data, offset)
+        offset += UINT16.size
+        aliases = {}
+        for _ in range(num_aliases):
+            alias, offset = _read_string(data, offset)
+            aliases[alias], offset = _read_string(data, offset)
+
+        entrance = None
+        if format_version >= 2:
+            (has_entrance,) = struct.unpack_from("<B", data, offset)
+            if has_entrance:
+                entrance = list(struct.unpack_from("<3i", data, offset + 1))
+            offset += 1 + (12 if has_entrance else 0)
+
+        connectors = []
+        if format_version >= 3:
+            (num_connectors,) = UINT32.unpack_from(data, offset)
+            offset += UINT32.size
+            for _ in range(num_connectors):
+                kind, *values, cost = CONNECTOR.unpack_from(data, offset)
+                offset += CONNECTOR.size
+                connector = {"kind": CONNECTOR_KINDS[kind], "from": values[:3], "to": values[3:]}
+                if cost:
+                    connector["cost"] = cost
+                connectors.append(connector)
+
+        facilities = {}
+        if format_version >= 4:
+            (num_categories,) = UINT16.unpack_from(data, offset)
+            offset += UINT16.size
+            for _ in range(num_categories):
+                category, offset = _read_string(data, offset)
+                (num_rooms,) = UINT16.unpack_from(data, offset)
+                offset += UINT16.size
+                room_names = []
+                for _ in range(num_rooms):
+                    room_name, offset = _read_string(data, offset)
+                    room_names.append(room_name)
+                facilities[category] = room_names
+    except (struct.error, IndexError, UnicodeDecodeError) as e:
+        raise ValueError(f"Corrupt binary map file: {e}")
+    layout = {"floors": floors, "stairs": stairs, "aliases": aliases}
+    if entrance is not None:
+        layout["entrance"] = entrance
+    if connectors:
+        layout["connectors"] = connectors
+    if facilities:
+        layout["facilities"] = facilities
+    return layout
+
+
+class MapStore:
+    def __init__(self, path, map_class=Map, poll_interval=MAP_RELOAD_INTERVAL, store_dir=MAP_STORE_DIR):
+        self.path = path
+        self.store_dir = store_dir
+        self.map_class = map_class
+        self.poll_interval = poll_interval
+        self.reloads = 0
+        self.loaded_at = None
+        self.last_error = None
+        self._signature = None
+        self._failed_signature = None
+        self._current = None
+        # Cells closed at runtime outlive reloads of the file. With a store
+        # directory they are kept there as well, so every worker closes the
+        # same cells; without one they belong to this process alone, and a
+        # server with several workers needs the store to close a cell.
+        self.blocked = set()
+        self._reload_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.reload()
+        if self._current is None:
+            raise ValueError(f"Could not load map from {path}: {self.last_error}")
+
+    def current(self):
+        # Handlers take one snapshot per request and use it throughout, so a
+        # reload that lands mid-request never mixes two layouts.
+        return self._current
+
+    def _file_signature(self):
+        # The map file's size and time, and the cells any worker has
+        # closed, so the watcher picks up a change to either.
+        stat = os.stat(self.path)
+        blocked = read_blocked(self.store_dir, self.path) if self.store_dir else None
+        return stat.st_mtime_ns, stat.st_size, blocked
+
+    def reload(self, force=True):
+        with self._reload_lock:
+            signature = None
+            try:
+                signature = self._file_signature()
+                if not force and signature in (self._signature, self._failed_signature):
+                    return False
+                if not force and self._signature is not None and signature[:2] == self._signature[:2] \
+                        and signature[2] is not None:
+                    # Only the cells closed by other workers have changed.
+                    self._apply_blocked(signature[2])
+                    self._signature = signature
+                    return True
+                layout = read_layout(self.path)
+                blocked = self.blocked if signature[2] is None else signature[2]
+                map_obj = self._build(layout, blocked)
+            except Exception as e:
+                # A hand-edited file can be wrong in more ways than the
+                # checks catch. Whatever goes wrong, the current map stays
+                # and the watcher keeps polling for a fixed file.
+                if str(e) != self.last_error:
+                    print(f"Map reload from {self.path} failed, keeping the current map: {e}")
+                self._failed_signature = signature
+                self.last_error = str(e)
+                return False
+            self._current = map_obj
+            self.blocked = set(blocked)
+            self._signature = signature
+            self._failed_signature = None
+            self.last_error = None
+            self.loaded_at = time.time()
+            self.reloads += 1
+            return True
+
+    def _build(self, layout, blocked):
+        map_obj = build_map(layout, self.map_class)
+        for cell in blocked:
+            if map_obj.in_bounds(*cell):
+                map_obj.block_cell(*cell)
+        # Routing tables grow a room's tree the first time it is asked for,
+        # so a new map is published without any searches. With a store
+        # directory each profile's trees are shared with every other worker
+        # through memory-mapped files, and only the first one builds each.
+        if self.store_dir:
+            for profile in PROFILES:
+                map_obj.use_routing_table(load_routing_table(self.store_dir, self.path, map_obj, profile), profile)
+        return map_obj
+
+    def block_cell(self, floor, x, y, on_change=None):
+        return self._change_cell((floor, x, y), True, on_change)
+
+    def unblock_cell(self, floor, x, y, on_change=None):
+        return self._change_cell((floor, x, y), False, on_change)
+
+    def _change_cell(self, cell, block, on_change):
+        # Closing or reopening a cell replaces the current map with a copy
+        # that differs in that cell (see Map.with_cell); requests already
+        # routing over the current map finish on it. on_change(old map, new
+        # map) runs as soon as the copy is current, before the change is
+        # written for the other workers. Returns the new map, or None if the
+        # cell already was that way.
+        with self._reload_lock:
+            current = self._current
+            map_obj = current.with_cell(*cell, block)
+            if map_obj is None:
+                return None
+            self._current = map_obj
+            if block:
+                self.blocked.add(cell)
+            else:
+                self.blocked.discard(cell)
+            if on_change is not None:
+                on_change(current, map_obj)
+            if self.store_dir:
+                shared = update_blocked(self.store_dir, self.path, cell, block)
+                if shared is not None:
+                    # Other workers may have closed cells this one has not
+                    # picked up yet. The watcher need not load the change
+                    # it was just told of.
+                    self._apply_blocked(shared)
+                    self._signature = self._signature[:2] + (shared,)
+            return self._current
+
+    def _apply_blocked(self, blocked):
+        # Brings the current map in line with the cells closed by every
+        # worker, one cell at a time.
+        map_obj = self._current
+        for cell in set(self.blocked) ^ set(blocked):
+            if map_obj.in_bounds(*cell):
+                map_obj = map_obj.with_cell(*cell, cell in blocked) or map_obj
+        self._current = map_obj
+        self.blocked = set(blocked)
+
+    def start(self):
+        if self._thread is None and self.poll_interval > 0:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._watch, name="map-reload", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def _watch(self):
+        while not self._stop.wait(self.poll_interval):
+            self.reload(force=False)
+
+    def status(self):
+        map_obj = self._current
+        return {
+            "path": self.path,
+            "version": map_obj.version,
+            "floors": map_obj.num_floors,
+            "loaded_at": self.loaded_at,
+            "reloads": self.reloads,
+            "last_error": self.last_error,
+            "watching": self._thread is not None,
+            "shared_store": getattr(map_obj.routing_table(), "path", None),
+        }
+
+
+if __name__ == "__main__":
+    # python map_loader.py maps/building.json maps/building.bin
+    if len(sys.argv) != 3:
+        sys.exit("usage: map_loader.py SOURCE DEST")
+    source, dest = sys.argv[1:]
+    layout = read_layout(source)
+    if dest.endswith(".bin"):
+        data = encode_binary(layout)
+        with open(dest, "wb") as f:
+            f.write(data)
+    else:
+        with open(dest, "w", encoding="utf-8") as f:
+            json.dump(layout, f)
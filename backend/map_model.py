@@ -0,0 +1,450 @@
+import copy
+import hashlib
+import itertools
+import json
+from array import array
+
+from components import ConnectedComponents
+from connectors import CONNECTOR_KINDS, DEFAULT_COSTS, Connector, ProfileTable
+from corridor_graph import CorridorGraph
+from facilities import DistanceField
+from hierarchical import HierarchicalPlanner
+from instructions import RouteInstructions
+from pathfinding import SearchEngine
+from routing_table import RoutingTable
+
+# Cells that are not rooms. Every other name on the grid is a room.
+PLAIN_CELLS = ('', 'X', '.', 'S', 'R')
+NO_CELL = 0
+NO_ROOM = -1
+
+
+class Map:
+    # Versions come from one counter shared by every map, so a reloaded map
+    # never reuses a version that something may still have cached.
+    _versions = itertools.count(1)
+    ROUTING_MODES = ('astar', 'alt', 'bidirectional', 'hierarchical', 'corridor')
+
+    def __init__(self, maps):
+        self.num_floors = len(maps)
+        # Floors may differ in size and need not be square. Flat cell
+        # indexes use the largest height and width over all floors; cells
+        # outside a smaller floor are never in bounds.
+        self.floor_dims = [
+            (len(floor_map), max((len(row) for row in floor_map), default=0)) if floor_map else (0, 0)
+            for floor_map in maps
+        ]
+        self.height = max((height for height, _ in self.floor_dims), default=0)
+        self.width = max((width for _, width in self.floor_dims), default=0)
+        self.num_cells = self.num_floors * self.height * self.width
+        # Each floor is kept flat, row by row at that floor's width, as a
+        # byte per cell that is 1 when the cell can be walked on and an
+        # id per cell into cell_names, the side table of what is written
+        # there: a wall, a corridor, a stair or a room name. Id 0 fills
+        # the slots past the end of a shorter row.
+        self.cell_names = [None]
+        self._cell_ids = {}
+        self._open_ids = bytearray(1)
+        # The flat index of each room's first cell, floor by floor and row
+        # by row, by cell id; NO_ROOM for ids that are not rooms.
+        self._first_cells = array('i', [NO_ROOM])
+        self.floor_passable = []
+        self.floor_cell_ids = []
+        # Every connector joins its two cells both ways. stairs maps a cell
+        # to all the cells linked to it, whatever the connector, and is what
+        # the unit-cost searches follow.
+        self.connectors = []
+        self.stairs = {}
+        self.room_names = {}
+        self.version = next(Map._versions)
+        # Copies made by with_cell share this map's layout and keep its
+        # layout version; only which cells are closed differs.
+        self.layout_version = self.version
+        self._clear_caches()
+        self.room_aliases = {}
+        self.blocked = {}
+        self.entrance = None
+        self.facilities = {}
+        rows = []
+        for floor, floor_map in enumerate(maps):
+            if floor_map is None:
+                rows.append(None)
+                continue
+            width = self.floor_dims[floor][1]
+            ids = []
+            for row in floor_map:
+                ids.extend(self._intern(cell) for cell in row)
+                ids.extend([NO_CELL] * (width - len(row)))
+            rows.append(ids)
+        # 16-bit ids unless the map has more distinct names than that.
+        typecode = 'H' if len(self.cell_names) <= 0x10000 else 'I'
+        for floor, ids in enumerate(rows):
+            if ids is None:
+                self.floor_passable.append(None)
+                self.floor_cell_ids.append(None)
+                continue
+            self.floor_passable.append(bytearray(map(self._open_ids.__getitem__, ids)))
+            self.floor_cell_ids.append(array(typecode, ids))
+            width = self.floor_dims[floor][1]
+            for cell_id in set(ids):
+                if self._is_room(cell_id) and self._first_cells[cell_id] == NO_ROOM:
+                    self._first_cells[cell_id] = self.cell_index(floor, *divmod(ids.index(cell_id), width))
+
+    def _intern(self, cell):
+        cell_id = self._cell_ids.get(cell)
+        if cell_id is None:
+            cell_id = len(self.cell_names)
+            self._cell_ids[cell] = cell_id
+            self.cell_names.append(cell)
+            self._open_ids.append(0 if cell == 'X' else 1)
+            self._first_cells.append(NO_ROOM)
+            if len(self.cell_names) == 0x10001:
+                # One name too many for 16-bit ids.
+                self.floor_cell_ids = [None if ids is None else array('I', ids) for ids in self.floor_cell_ids]
+        return cell_id
+
+    def _clear_caches(self):
+        self._routing_table = None
+        self._search_engine = None
+        self._hierarchical_planner = None
+        self._corridor_graph = None
+        self._route_instructions = None
+        self._print_map_cache = None
+        self._components = None
+        self._facility_fields = None
+        self._profile_tables = None
+
+    def _is_room(self, cell_id):
+        return cell_id != NO_CELL and self.cell_names[cell_id] not in PLAIN_CELLS
+
+    def _position(self, floor, x, y):
+        return x * self.floor_dims[floor][1] + y
+
+    def is_open(self, floor, x, y):
+        return self.floor_passable[floor][self._position(floor, x, y)] == 1
+
+    def cell_value(self, floor, x, y):
+        # What the cell reads as: its own name, or X while it is closed.
+        position = self._position(floor, x, y)
+        if not self.floor_passable[floor][position]:
+            return 'X'
+        return self.cell_names[self.floor_cell_ids[floor][position]]
+
+    def add_stairs(self, start_floor, start_x, start_y, end_floor, end_x, end_y):
+        self.add_connector('stairs', start_floor, start_x, start_y, end_floor, end_x, end_y)
+
+    def add_connector(self, kind, start_floor, start_x, start_y, end_floor, end_x, end_y, cost=None):
+        if kind not in CONNECTOR_KINDS:
+            raise ValueError("Unknown connector kind")
+        if end_floor < 0 or end_floor >= self.num_floors or start_floor < 0 or start_floor >= self.num_floors:
+            raise ValueError("Invalid floor number")
+        if self.floor_cell_ids[end_floor] is None or self.floor_cell_ids[start_floor] is None:
+            raise ValueError("Floor not initialized")
+        if not self.in_bounds(start_floor, start_x, start_y) or not self.in_bounds(end_floor, end_x, end_y):
+            raise ValueError("Invalid stair position")
+        source = (start_floor, start_x, start_y)
+        dest = (end_floor, end_x, end_y)
+        if source == dest:
+            raise ValueError("Connector must join two cells")
+        if cost is None:
+            cost = DEFAULT_COSTS[kind]
+        elif cost < 1:
+            raise ValueError("Connector cost must be at least 1")
+        self.connectors.append(Connector(kind, source, dest, cost))
+        if dest not in self.stairs.get(source, ()):
+            self.stairs.setdefault(source, []).append(dest)
+            self.stairs.setdefault(dest, []).append(source)
+        if kind == 'stairs':
+            self.set_cell(start_floor, start_x, start_y, 'S')
+            self.set_cell(end_floor, end_x, end_y, 'S')
+        else:
+            self.version = next(Map._versions)
+
+    def set_cell(self, floor, x, y, value):
+        self.blocked.pop((floor, x, y), None)
+        position = self._position(floor, x, y)
+        cell_id = self._intern(value)
+        previous_id = self.floor_cell_ids[floor][position]
+        self.floor_cell_ids[floor][position] = cell_id
+        self.floor_passable[floor][position] = self._open_ids[cell_id]
+        index = self.cell_index(floor, x, y)
+        if self._first_cells[previous_id] == index:
+            # The room's first cell is gone; its next one, if any, is
+            # further on in scan order.
+            self._first_cells[previous_id] = self._find_cell(previous_id, floor, position)
+        first = self._first_cells[cell_id]
+        if self._is_room(cell_id) and (first == NO_ROOM or first > index):
+            self._first_cells[cell_id] = index
+        self.version = next(Map._versions)
+
+    def _find_cell(self, cell_id, floor, position):
+        for floor in range(floor, self.num_floors):
+            ids = self.floor_cell_ids[floor]
+            if ids is not None:
+                try:
+                    position = ids.index(cell_id, position)
+                except ValueError:
+                    pass
+                else:
+                    return self.cell_index(floor, *divmod(position, self.floor_dims[floor][1]))
+            position = 0
+        return NO_ROOM
+
+    def block_cell(self, floor, x, y):
+        # A blocked cell reads as a wall to every search, but remembers what
+        # it was and stays in the room index, so a closed room is reported
+        # as unreachable rather than unknown.
+        if not self.in_bounds(floor, x, y):
+            raise ValueError("Invalid cell position")
+        position = self._position(floor, x, y)
+        if not self.floor_passable[floor][position]:
+            return False
+        self.blocked[(floor, x, y)] = self.cell_names[self.floor_cell_ids[floor][position]]
+        self.floor_passable[floor][position] = 0
+        self.version = next(Map._versions)
+        return True
+
+    def unblock_cell(self, floor, x, y):
+        if not self.in_bounds(floor, x, y):
+            raise ValueError("Invalid cell position")
+        if self.blocked.pop((floor, x, y), None) is None:
+            return False
+        self.floor_passable[floor][self._position(floor, x, y)] = 1
+        self.version = next(Map._versions)
+        return True
+
+    def with_cell(self, floor, x, y, block):
+        # A copy of the map with one cell closed or reopened, or None if it
+        # already was that way; requests still on this map are undisturbed.
+        # Nothing is searched here: the search engine is patched, and the
+        # routing trees the change leaves as they were are carried over.
+        # Everything else is rebuilt when it is next asked for.
+        if not self.in_bounds(floor, x, y):
+            raise ValueError("Invalid cell position")
+        position = self._position(floor, x, y)
+        if block:
+            if not self.floor_passable[floor][position]:
+                return None
+        elif (floor, x, y) not in self.blocked:
+            return None
+        changed = copy.copy(self)
+        changed._clear_caches()
+        changed.floor_passable = [None if passable is None else bytearray(passable) for passable in self.floor_passable]
+        changed.blocked = dict(self.blocked)
+        if block:
+            changed.blocked[(floor, x, y)] = self.cell_names[self.floor_cell_ids[floor][position]]
+        else:
+            del changed.blocked[(floor, x, y)]
+        changed.floor_passable[floor][position] = 0 if block else 1
+        changed.version = next(Map._versions)
+
+        index = self.cell_index(floor, x, y)
+        engine = self._search_engine
+        if engine is not None and engine.version == self.version:
+            changed._search_engine = engine.with_cell(changed.version, index, not block)
+        table = self._routing_table
+        if table is not None and table.version == self.version:
+            changed._routing_table = table.renew(changed)
+            changed._routing_table.keep_trees(table, index, block)
+        tables = self._profile_tables
+        if tables is not None and tables[0] == self.version:
+            changed._profile_tables = (changed.version, {})
+            for profile, table in tables[1].items():
+                changed._profile_tables[1][profile] = table.renew(changed)
+                changed._profile_tables[1][profile].keep_trees(table, index, block)
+        return changed
+
+    def room_at(self, floor, x, y):
+        cell = self.cell_names[self.floor_cell_ids[floor][self._position(floor, x, y)]]
+        if cell == 'R':
+            cell = self.room_names.get((floor, x, y), "")
+        if cell in PLAIN_CELLS:
+            return None
+        return cell
+
+    def add_alias(self, alias, room_name):
+        if self._first_cell(room_name) == NO_ROOM:
+            raise ValueError("Unknown room")
+        self.room_aliases[alias] = room_name
+
+    def resolve_room(self, room_name):
+        room_name = self.room_aliases.get(room_name, room_name)
+        if self._first_cell(room_name) != NO_ROOM:
+            return room_name
+        return None
+
+    def _first_cell(self, room_name):
+        cell_id = self._cell_ids.get(room_name)
+        return NO_ROOM if cell_id is None else self._first_cells[cell_id]
+
+    def in_bounds(self, floor, x, y):
+        if not 0 <= floor < self.num_floors:
+            return False
+        height, width = self.floor_dims[floor]
+        if not (0 <= x < height and 0 <= y < width):
+            return False
+        return self.floor_cell_ids[floor][x * width + y] != NO_CELL
+
+    def cell_index(self, floor, x, y):
+        return (floor * self.height + x) * self.width + y
+
+    def cell_at(self, index):
+        floor, rest = divmod(index, self.height * self.width)
+        x, y = divmod(rest, self.width)
+        return floor, x, y
+
+    def room_cells(self):
+        for cell_id, index in enumerate(self._first_cells):
+            if index != NO_ROOM:
+                yield self.cell_names[cell_id], self.cell_at(index)
+
+    def routing_table(self):
+        table = self._routing_table
+        if table is None or table.version != self.version:
+            table = RoutingTable(self)
+            self._routing_table = table
+        return table
+
+    def use_routing_table(self, table, profile='default'):
+        if table.version != self.version:
+            raise ValueError("Routing table was built for another map version")
+        if profile == 'default':
+            self._routing_table = table
+            return
+        tables = self._profile_tables
+        if tables is None or tables[0] != self.version:
+            tables = (self.version, {})
+            self._profile_tables = tables
+        tables[1][profile] = table
+
+    def route_instructions(self):
+        instructions = self._route_instructions
+        if instructions is None or instructions.version != self.version:
+            instructions = RouteInstructions(self)
+            self._route_instructions = instructions
+        return instructions
+
+    def components(self):
+        components = self._components
+        if components is None or components.version != self.version:
+            components = ConnectedComponents(self)
+            self._components = components
+        return components
+
+    def facility_field(self, category):
+        fields = self._facility_fields
+        if fields is None or fields[0] != self.version:
+            fields = (self.version, {})
+            self._facility_fields = fields
+        field = fields[1].get(category)
+        if field is None:
+            field = DistanceField(self, category)
+            fields[1][category] = field
+        return field
+
+    def profile_table(self, profile):
+        if profile == 'default':
+            return self.routing_table()
+        tables = self._profile_tables
+        if tables is None or tables[0] != self.version:
+            tables = (self.version, {})
+            self._profile_tables = tables
+        table = tables[1].get(profile)
+        if table is None:
+            table = ProfileTable(self, profile)
+            tables[1][profile] = table
+        return table
+
+    def unreachable_rooms(self, start):
+        components = self.components()
+        return [room_name for room_name, cell in self.room_cells() if not components.may_reach(start, cell)]
+
+    def search_engine(self):
+        engine = self._search_engine
+        if engine is None or engine.version != self.version:
+            engine = SearchEngine(self)
+            self._search_engine = engine
+        return engine
+
+    def hierarchical_planner(self):
+        planner = self._hierarchical_planner
+        if planner is None or planner.version != self.version:
+            planner = HierarchicalPlanner(self.search_engine())
+            self._hierarchical_planner = planner
+        return planner
+
+    def corridor_graph(self):
+        graph = self._corridor_graph
+        if graph is None or graph.version != self.version:
+            graph = CorridorGraph(self)
+            self._corridor_graph = graph
+        return graph
+
+    def print_map(self):
+        return [self.print_floor(floor) for floor in range(self.num_floors)]
+
+    def print_floor(self, floor):
+        ids = self.floor_cell_ids[floor]
+        passable = self.floor_passable[floor]
+        height, width = self.floor_dims[floor]
+        cell_names = self.cell_names
+        floor_result = []
+        for i in range(height):
+            start = i * width
+            end = start + width
+            while end > start and ids[end - 1] == NO_CELL:
+                end -= 1
+            row_result = [
+                cell_names[cell_id] if is_open else 'X' for cell_id, is_open in zip(ids[start:end], passable[start:end])
+            ]
+            if 'R' in row_result:
+                row_result = [
+                    self.room_names.get((floor, i, j), "") if cell == 'R' else cell for j, cell in enumerate(row_result)
+                ]
+            floor_result.append(row_result)
+        return floor_result
+
+    def print_map_json(self, floor=None):
+        # The serialized map, whole or one floor, with a strong ETag taken
+        # from its bytes, so every worker hands out the same tag for the
+        # same layout. Built once per map version.
+        cache = self._print_map_cache
+        if cache is None or cache[0] != self.version:
+            cache = (self.version, {})
+            self._print_map_cache = cache
+        entry = cache[1].get(floor)
+        if entry is None:
+            layout = self.print_map() if floor is None else self.print_floor(floor)
+            body = json.dumps(layout, separators=(',', ':')).encode('utf-8')
+            entry = (body, '"' + hashlib.sha256(body).hexdigest()[:32] + '"')
+            cache[1][floor] = entry
+        return entry
+
+    def find_route(self, start_floor, start_x, start_y, end_floor, end_x, end_y, mode='astar'):
+        start = (start_floor, start_x, start_y)
+        goal = (end_floor, end_x, end_y)
+        if mode not in self.ROUTING_MODES:
+            raise ValueError("Unknown routing mode")
+        if not self.components().may_reach(start, goal):
+            return None
+        if mode == 'astar':
+            return self.search_engine().find_route(start, goal)
+        if mode == 'alt':
+            return self.search_engine().find_route(start, goal, heuristic='alt')
+        if mode == 'bidirectional':
+            return self.search_engine().find_route_bidirectional(start, goal)
+        if mode == 'hierarchical':
+            return self.hierarchical_planner().find_route(start, goal)
+        return self.corridor_graph().find_route(start, goal)
+
+    def find_routes(self, start, goals):
+        components = self.components()
+        reachable = [goal for goal in goals if components.may_reach(start, goal)]
+        routes = dict(zip(reachable, self.search_engine().find_routes_from(start, reachable)))
+        return [routes.get(goal) for goal in goals]
+
+    def get_room_coordinates(self, room_name):
+        room_name = self.resolve_room(room_name)
+        if room_name is None:
+            return None
+        return self.cell_at(self._first_cell(room_name))
@@ -0,0 +1,501 @@
+from fastapi import APIRouter, Header, HTTPException, Query
+from fastapi.responses import JSONResponse, Response
+from pydantic import BaseModel
+from typing import List, Optional
+
+import json
+
+from campus import CAMPUS_FILE, CampusRegistry
+from connectors import PROFILES
+from facilities import BUILT_IN_CATEGORIES
+from incremental import NavigationSessions
+from map_loader import MAP_FILE, MapStore
+from map_model import Map
+from route_cache import RouteCache
+from route_encoding import (BINARY_MEDIA_TYPE, INSTRUCTIONS_MEDIA_TYPE, RUNS_MEDIA_TYPE, choose_format, encode_binary,
+                            encode_runs)
+from tour import INFINITY, MAX_STOPS, RoomDistances, plan_tour
+
+# The routing endpoints. navigation.py serves them on their own and main.py
+# alongside the speech and chat endpoints.
+router = APIRouter()
+
+# The building layout lives in a data file and is reloaded whenever it
+# changes; see map_loader.py.
+map_store = MapStore(MAP_FILE, Map)
+
+@router.on_event("startup")
+def start_map_reload():
+    map_store.start()
+
+@router.on_event("shutdown")
+def stop_map_reload():
+    map_store.stop()
+    campus.stop()
+
+route_cache = RouteCache()
+# Other buildings on the campus, each loaded on first use; see campus.py.
+campus = CampusRegistry(CAMPUS_FILE, Map, pinned=[(map_store, route_cache)])
+sessions = NavigationSessions()
+
+class RoomRequest(BaseModel):
+    room_name: str
+
+class RouteRequest(BaseModel):
+    start_room: str
+    end_room: str
+    mode: Optional[str] = None
+    profile: Optional[str] = None
+
+class RoutesRequest(BaseModel):
+    routes: List[RouteRequest]
+
+class TourRequest(BaseModel):
+    rooms: List[str]
+    start_room: Optional[str] = None
+    return_to_start: bool = False
+
+class NearestRequest(BaseModel):
+    category: str
+    start_room: Optional[str] = None
+    floor: Optional[int] = None
+    x: Optional[int] = None
+    y: Optional[int] = None
+
+class CellRequest(BaseModel):
+    floor: int
+    x: int
+    y: int
+
+class CampusRouteRequest(BaseModel):
+    start_building: str
+    start_room: str
+    end_building: str
+    end_room: str
+
+class SessionRequest(BaseModel):
+    start_room: str
+    end_room: str
+
+class PositionRequest(BaseModel):
+    floor: int
+    x: int
+    y: int
+    room_name: str
+    profile: Optional[str] = None
+
+def open_building(building):
+    # The map and route cache a request is answered from: the campus
+    # building it names, or this deployment's own.
+    if building is None:
+        return map_store.current(), route_cache
+    try:
+        return campus.open(building)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Building not found")
+    except ValueError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+def building_map(building):
+    return open_building(building)[0]
+
+@router.post("/get_room_coordinates")
+def get_room_coordinates(request: RoomRequest, building: Optional[str] = None):
+    map_obj = building_map(building)
+    coords = map_obj.get_room_coordinates(request.room_name)
+    if coords is None:
+        raise HTTPException(status_code=404, detail="Room not found")
+    return {"floor": coords[0], "x": coords[1], "y": coords[2]}
+
+@router.get("/rooms")
+def list_rooms(building: Optional[str] = None):
+    map_obj = building_map(building)
+    rooms = []
+    for room_name, (floor, x, y) in map_obj.room_cells():
+        rooms.append({"name": room_name, "floor": floor, "x": x, "y": y})
+    return {"rooms": rooms, "aliases": map_obj.room_aliases}
+
+@router.get("/profiles")
+def list_profiles(building: Optional[str] = None):
+    # The routing profiles /find_route accepts, and the connectors between
+    # floors they choose from.
+    map_obj = building_map(building)
+    connectors = [{"kind": connector.kind, "from": list(connector.source), "to": list(connector.dest),
+                   "cost": connector.cost} for connector in map_obj.connectors]
+    return {"profiles": list(PROFILES), "connectors": connectors}
+
+@router.post("/find_route")
+def find_route(request: RouteRequest, route_format: Optional[str] = Query(None, alias="format"),
+               accept: Optional[str] = Header(None), building: Optional[str] = None):
+    # The route is a list of [floor, x, y] cells unless ?format= or the
+    # Accept header asks for run-length steps, packed binary or
+    # turn-by-turn instructions.
+    try:
+        route_format = choose_format(route_format, accept)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    map_obj, cache = open_building(building)
+    route = lookup_route(map_obj, request, cache)
+    if route_format == 'instructions':
+        return JSONResponse({"instructions": lookup_instructions(map_obj, request, route, cache)},
+                            media_type=INSTRUCTIONS_MEDIA_TYPE)
+    if route_format == 'runs':
+        return JSONResponse({"route": encode_runs(route)}, media_type=RUNS_MEDIA_TYPE)
+    if route_format == 'binary':
+        return Response(encode_binary(route), media_type=BINARY_MEDIA_TYPE)
+    return {"route": route}
+
+def lookup_instructions(map_obj, request: RouteRequest, route, cache):
+    # Cached next to the route itself, under the same version.
+    end_room = map_obj.resolve_room(request.end_room)
+    cache_key = ('instructions', map_obj.resolve_room(request.start_room), end_room, request.mode,
+                 request.profile or 'default')
+    instructions = cache.get(cache_key, map_obj.version)
+    if instructions is None:
+        instructions = map_obj.route_instructions().describe(route, end_room)
+        cache.put(cache_key, map_obj.version, instructions)
+    return instructions
+
+def route_profile(request: RouteRequest):
+    profile = request.profile or 'default'
+    if profile not in PROFILES:
+        raise HTTPException(status_code=400, detail="Unknown routing profile")
+    if profile != 'default' and request.mode is not None:
+        raise HTTPException(status_code=400, detail="A routing profile cannot be combined with a search mode")
+    if request.mode is not None and request.mode not in Map.ROUTING_MODES:
+        raise HTTPException(status_code=400, detail="Unknown routing mode")
+    return profile
+
+def lookup_route(map_obj, request: RouteRequest, cache):
+    start_coords = map_obj.get_room_coordinates(request.start_room)
+    end_coords = map_obj.get_room_coordinates(request.end_room)
+
+    if start_coords is None:
+        raise HTTPException(status_code=404, detail="Start room not found")
+    if end_coords is None:
+        raise HTTPException(status_code=404, detail="End room not found")
+
+    start_room = map_obj.resolve_room(request.start_room)
+    end_room = map_obj.resolve_room(request.end_room)
+    profile = route_profile(request)
+    cache_key = (start_room, end_room, request.mode, profile)
+    route = cache.get(cache_key, map_obj.version)
+    if route is not None:
+        return route
+
+    table = map_obj.routing_table()
+    if profile != 'default':
+        # Profiles weigh connectors differently, so each has its own table
+        # built when the map is loaded.
+        profile_table = map_obj.profile_table(profile)
+        if start_room in profile_table and end_room in profile_table:
+            route = profile_table.route(start_room, end_room)
+    elif request.mode is None and start_room in table and end_room in table:
+        route = table.route(start_room, end_room)
+    else:
+        start_floor, start_x, start_y = start_coords
+        end_floor, end_x, end_y = end_coords
+        try:
+            route = map_obj.find_route(start_floor, start_x, start_y, end_floor, end_x, end_y,
+                                       mode=request.mode or 'astar')
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    if route is None:
+        route = []
+
+    cache.put(cache_key, map_obj.version, route)
+    return route
+
+@router.post("/navigate")
+def navigate(request: RouteRequest, building: Optional[str] = None):
+    # Everything a kiosk needs to show a route in one round trip: where
+    # both rooms are, the route, and the floors it crosses. The floors are
+    # spliced in from their cached JSON rather than serialized again.
+    map_obj, cache = open_building(building)
+    route = lookup_route(map_obj, request, cache)
+    ends = {}
+    for key, room_name in (("start", request.start_room), ("end", request.end_room)):
+        floor, x, y = map_obj.get_room_coordinates(room_name)
+        ends[key] = {"room": map_obj.resolve_room(room_name), "floor": floor, "x": x, "y": y}
+    floors = sorted({ends["start"]["floor"], ends["end"]["floor"]} | {cell[0] for cell in route})
+    head = json.dumps({**ends, "route": route}, separators=(',', ':'))
+    parts = [head[:-1].encode('utf-8'), b',"floors":{']
+    for i, floor in enumerate(floors):
+        parts.append(b'%s"%d":' % (b',' if i else b'', floor))
+        parts.append(map_obj.print_map_json(floor)[0])
+    parts.append(b'}}')
+    return Response(b''.join(parts), media_type="application/json")
+
+@router.get("/route_cache/stats")
+def route_cache_stats(building: Optional[str] = None):
+    return open_building(building)[1].stats()
+
+@router.post("/find_routes")
+def find_routes(request: RoutesRequest, building: Optional[str] = None):
+    map_obj = building_map(building)
+    # Group the pairs by start cell, profile and mode so each distinct
+    # default origin costs a single search, however many destinations are
+    # asked for from it. Profiles read their own table; an explicit mode
+    # runs that search per pair.
+    goals_by_start = {}
+    resolved = []
+    for pair in request.routes:
+        start_coords = map_obj.get_room_coordinates(pair.start_room)
+        end_coords = map_obj.get_room_coordinates(pair.end_room)
+        if start_coords is None:
+            raise HTTPException(status_code=404, detail=f"Start room not found: {pair.start_room}")
+        if end_coords is None:
+            raise HTTPException(status_code=404, detail=f"End room not found: {pair.end_room}")
+        key = (map_obj.resolve_room(pair.start_room), start_coords, route_profile(pair), pair.mode)
+        goals_by_start.setdefault(key, []).append((map_obj.resolve_room(pair.end_room), end_coords))
+        resolved.append((pair, key, end_coords))
+
+    routes_by_pair = {}
+    for key, goals in goals_by_start.items():
+        start_room, start_coords, profile, mode = key
+        if profile != 'default':
+            profile_table = map_obj.profile_table(profile)
+            for end_room, end_coords in goals:
+                route = None
+                if start_room in profile_table and end_room in profile_table:
+                    route = profile_table.route(start_room, end_room)
+                routes_by_pair[key + (end_coords,)] = route or []
+        elif mode is not None:
+            for end_room, end_coords in goals:
+                route = map_obj.find_route(*start_coords, *end_coords, mode=mode)
+                routes_by_pair[key + (end_coords,)] = route or []
+        else:
+            ends = [end_coords for end_room, end_coords in goals]
+            for end_coords, route in zip(ends, map_obj.find_routes(start_coords, ends)):
+                routes_by_pair[key + (end_coords,)] = route or []
+
+    results = []
+    for pair, key, end_coords in resolved:
+        route = routes_by_pair[key + (end_coords,)]
+        results.append({"start_room": pair.start_room, "end_room": pair.end_room, "route": route})
+    return {"routes": results}
+
+@router.post("/find_tour")
+def find_tour(request: TourRequest, building: Optional[str] = None):
+    # Visits every room once, starting from start_room (or the first room
+    # listed), in the order that walks the least.
+    map_obj = building_map(building)
+    names = []
+    for room_name in ([request.start_room] if request.start_room else []) + request.rooms:
+        resolved = map_obj.resolve_room(room_name)
+        if resolved is None:
+            raise HTTPException(status_code=404, detail=f"Room not found: {room_name}")
+        names.append(resolved)
+    if not names:
+        raise HTTPException(status_code=400, detail="No rooms given")
+    if len(set(names)) > MAX_STOPS:
+        raise HTTPException(status_code=400, detail=f"A tour can visit at most {MAX_STOPS} rooms")
+
+    start = names[0]
+    table = map_obj.routing_table()
+    order, distance = plan_tour(RoomDistances(table, names), start, names[1:],
+                                start if request.return_to_start else None)
+    if distance == INFINITY:
+        raise HTTPException(status_code=400, detail="Some rooms cannot be reached")
+
+    route = [map_obj.cell_at(table.rooms[start])]
+    legs = []
+    for start_room, end_room in zip(order, order[1:]):
+        route.extend(table.route(start_room, end_room)[1:])
+        legs.append({"start_room": start_room, "end_room": end_room,
+                     "distance": table.route_distance(start_room, end_room)})
+    return {"order": order, "distance": distance, "legs": legs, "route": route}
+
+@router.get("/facilities")
+def list_facilities(building: Optional[str] = None):
+    map_obj = building_map(building)
+    return {"categories": list(BUILT_IN_CATEGORIES) + list(map_obj.facilities), "tags": map_obj.facilities}
+
+@router.post("/nearest")
+def nearest_facility(request: NearestRequest, building: Optional[str] = None):
+    # Nearest stairs, exit or tagged room from a room or a cell: one lookup
+    # in the category's distance field, then a walk down it.
+    map_obj = building_map(building)
+    if request.start_room is not None:
+        start = map_obj.get_room_coordinates(request.start_room)
+        if start is None:
+            raise HTTPException(status_code=404, detail="Start room not found")
+    elif None in (request.floor, request.x, request.y):
+        raise HTTPException(status_code=400, detail="Give a start_room or a floor, x and y")
+    else:
+        start = (request.floor, request.x, request.y)
+        if not map_obj.in_bounds(*start):
+            raise HTTPException(status_code=400, detail="Invalid cell position")
+    try:
+        field = map_obj.facility_field(request.category)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+    route = field.route_from(*start)
+    if route is None:
+        return {"category": request.category, "distance": None, "facility": None, "route": []}
+    floor, x, y = route[-1]
+    facility = {"floor": floor, "x": x, "y": y, "room": map_obj.room_at(floor, x, y)}
+    return {"category": request.category, "distance": len(route) - 1, "facility": facility, "route": route}
+
+@router.get("/evacuation/{floor}")
+def evacuation_directions(floor: int, building: Optional[str] = None):
+    # The next step towards the nearest exit from every cell of a floor.
+    map_obj = building_map(building)
+    if not 0 <= floor < map_obj.num_floors:
+        raise HTTPException(status_code=404, detail="Floor not found")
+    return {"floor": floor, "directions": map_obj.facility_field('exits').directions(floor)}
+
+@router.post("/cells/block")
+def block_cell(request: CellRequest):
+    return change_cell(request, block=True)
+
+@router.post("/cells/unblock")
+def unblock_cell(request: CellRequest):
+    return change_cell(request, block=False)
+
+def change_cell(request: CellRequest, block):
+    # Sessions walking the map are repaired as soon as the changed map is
+    # current, before the change is shared with the other workers.
+    map_obj = map_store.current()
+    cell = (request.floor, request.x, request.y)
+    updated = []
+
+    def repair_sessions(old_map, new_map):
+        updated.append(sessions.cells_changed(old_map, new_map, [cell]))
+
+    try:
+        if block:
+            new_map = map_store.block_cell(*cell, on_change=repair_sessions)
+        else:
+            new_map = map_store.unblock_cell(*cell, on_change=repair_sessions)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if new_map is None:
+        return {"changed": False, "version": map_obj.version, "sessions_updated": 0}
+    return {"changed": True, "version": new_map.version, "sessions_updated": sum(updated)}
+
+@router.get("/cells/blocked")
+def blocked_cells():
+    map_obj = map_store.current()
+    return {"cells": [{"floor": floor, "x": x, "y": y} for floor, x, y in sorted(map_obj.blocked)]}
+
+@router.post("/route_from_position")
+def route_from_position(request: PositionRequest, building: Optional[str] = None):
+    # A route back to a room from wherever the walker now stands, read off
+    # the tree the profile's routing table keeps for that room. The table
+    # holds the trees of the rooms asked about most recently.
+    map_obj = building_map(building)
+    if not map_obj.in_bounds(request.floor, request.x, request.y):
+        raise HTTPException(status_code=400, detail="Invalid cell position")
+    room_name = map_obj.resolve_room(request.room_name)
+    if room_name is None:
+        raise HTTPException(status_code=404, detail="Room not found")
+    profile = request.profile or 'default'
+    if profile not in PROFILES:
+        raise HTTPException(status_code=400, detail="Unknown routing profile")
+    position = (request.floor, request.x, request.y)
+    route = distance = None
+    table = map_obj.profile_table(profile)
+    if room_name in table:
+        route = table.route_from_cell(position, room_name)
+        distance = table.distance_from_cell(position, room_name)
+    return {"room": room_name, "distance": distance, "route": route or []}
+
+@router.post("/sessions")
+def create_session(request: SessionRequest):
+    map_obj = map_store.current()
+    start_coords = map_obj.get_room_coordinates(request.start_room)
+    if start_coords is None:
+        raise HTTPException(status_code=404, detail="Start room not found")
+    if map_obj.get_room_coordinates(request.end_room) is None:
+        raise HTTPException(status_code=404, detail="End room not found")
+    session_id, route = sessions.create(map_obj, start_coords, request.end_room)
+    return {"session_id": session_id, "route": route or []}
+
+@router.get("/sessions/{session_id}")
+def session_route(session_id: str):
+    try:
+        route = sessions.route(session_id, map_store.current())
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return {"session_id": session_id, "route": route or []}
+
+@router.post("/sessions/{session_id}/position")
+def move_session(session_id: str, request: CellRequest):
+    map_obj = map_store.current()
+    if not map_obj.in_bounds(request.floor, request.x, request.y):
+        raise HTTPException(status_code=400, detail="Invalid cell position")
+    try:
+        route = sessions.move(session_id, map_obj, request.floor, request.x, request.y)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return {"session_id": session_id, "route": route or []}
+
+@router.delete("/sessions/{session_id}")
+def end_session(session_id: str):
+    try:
+        sessions.remove(session_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return {"session_id": session_id}
+
+@router.get("/diagnostics/unreachable_rooms")
+def unreachable_rooms():
+    # Rooms no route leads to from the building's main entrance, which
+    # usually means a map editing mistake or a closed corridor.
+    map_obj = map_store.current()
+    if map_obj.entrance is None:
+        raise HTTPException(status_code=404, detail="No entrance configured")
+    floor, x, y = map_obj.entrance
+    return {
+        "entrance": {"floor": floor, "x": x, "y": y},
+        "rooms": sorted(map_obj.unreachable_rooms(map_obj.entrance)),
+        "components": map_obj.components().count,
+    }
+
+@router.get("/campus")
+def campus_status():
+    return campus.status()
+
+@router.post("/campus/route")
+def campus_route(request: CampusRouteRequest):
+    # A walk between rooms in two buildings, as indoor legs joined by the
+    # outdoor links between them.
+    for building in (request.start_building, request.end_building):
+        open_building(building)
+    try:
+        result = campus.route(request.start_building, request.start_room, request.end_building, request.end_room)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    if result is None:
+        return {"distance": None, "legs": []}
+    distance, legs = result
+    return {"distance": distance, "legs": [
+        {"building": building, "route": route} if building is not None else
+        {"outdoor": {"from": list(route[0]), "to": list(route[1])}}
+        for building, route in legs]}
+
+@router.get("/map/status")
+def map_status():
+    return map_store.status()
+
+@router.get("/print_map")
+def print_map(if_none_match: Optional[str] = Header(None), building: Optional[str] = None):
+    return map_json_response(building_map(building).print_map_json(), if_none_match)
+
+@router.get("/print_map/{floor}")
+def print_floor(floor: int, if_none_match: Optional[str] = Header(None), building: Optional[str] = None):
+    map_obj = building_map(building)
+    if not 0 <= floor < map_obj.num_floors:
+        raise HTTPException(status_code=404, detail="Floor not found")
+    return map_json_response(map_obj.print_map_json(floor), if_none_match)
+
+def map_json_response(entry, if_none_match):
+    body, etag = entry
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        if "*" in tags or etag in tags or "W/" + etag in tags:
+            return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
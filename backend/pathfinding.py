@@ -0,0 +1,428 @@
+import copy
+import heapq
+import math
+import threading
+from collections import deque
+
+VERTICAL_COST = 5
+NUM_LANDMARKS = 8
+UNREACHABLE = -1
+HEURISTICS = ('manhattan', 'alt')
+
+
+class SearchEngine:
+    def __init__(self, map_obj):
+        self.version = map_obj.version
+        self.num_floors = map_obj.num_floors
+        self.height = map_obj.height
+        self.width = map_obj.width
+        self.floor_cells = self.height * self.width
+        size = self.num_floors * self.floor_cells
+
+        self.passable = bytearray(size)
+        for floor, floor_passable in enumerate(map_obj.floor_passable):
+            height, width = map_obj.floor_dims[floor]
+            for x in range(height):
+                start = self.cell_index(floor, x, 0)
+                self.passable[start:start + width] = floor_passable[x * width:(x + 1) * width]
+        self.stairs = {
+            map_obj.cell_index(*source): [map_obj.cell_index(*dest) for dest in dests]
+            for source, dests in map_obj.stairs.items()
+        }
+        self.stairs_into = {}
+        for source, dests in self.stairs.items():
+            for dest in dests:
+                self.stairs_into.setdefault(dest, []).append(source)
+        self._reset()
+
+    def _reset(self):
+        # Scores and parents are reused between searches. A slot is only
+        # valid when its stamp equals the current search's generation, so
+        # nothing has to be cleared before the next request.
+        size = len(self.passable)
+        self.g_score = [0] * size
+        self.came_from = [0] * size
+        self.seen = [0] * size
+        self.closed = [0] * size
+        self.generation = 0
+        self.expanded = 0
+        self.landmarks = None
+        self._backward = None
+        self._lock = threading.Lock()
+
+    def with_cell(self, version, index, is_open):
+        # A copy for the next version of the map, with one cell opened or
+        # closed, and nothing searched again. Landmarks are chosen afresh
+        # when next needed, as their distances may no longer hold.
+        engine = copy.copy(self)
+        engine.version = version
+        engine.passable = bytearray(self.passable)
+        engine.passable[index] = 1 if is_open else 0
+        engine._reset()
+        return engine
+
+    def cell_index(self, floor, x, y):
+        return (floor * self.height + x) * self.width + y
+
+    def cell_at(self, index):
+        floor, rest = divmod(index, self.floor_cells)
+        x, y = divmod(rest, self.width)
+        return floor, x, y
+
+    def neighbors(self, index):
+        # The cells one step away on the same floor, open or not, in the
+        # order every search tries them: down, up, left, right.
+        width = self.width
+        x, y = divmod(index % self.floor_cells, width)
+        neighbors = []
+        if x + 1 < self.height:
+            neighbors.append(index + width)
+        if x > 0:
+            neighbors.append(index - width)
+        if y > 0:
+            neighbors.append(index - 1)
+        if y + 1 < width:
+            neighbors.append(index + 1)
+        return neighbors
+
+    def find_route(self, start, goal, heuristic='manhattan', vertical_cost=VERTICAL_COST):
+        # vertical_cost weighs floor changes in the Manhattan estimate. The
+        # default overestimates a one-step stair on purpose to keep searches
+        # on the current floor; 1 makes it a lower bound where stairs keep
+        # their x and y.
+        if heuristic not in HEURISTICS:
+            raise ValueError("Unknown heuristic")
+        with self._lock:
+            if heuristic == 'alt' and self.landmarks is None:
+                self._select_landmarks()
+            path = self._search(self.cell_index(*start), self.cell_index(*goal), heuristic == 'alt', vertical_cost)
+        if path is None:
+            return None
+        return [self.cell_at(index) for index in path]
+
+    def find_route_bidirectional(self, start, goal):
+        with self._lock:
+            if self.landmarks is None:
+                self._select_landmarks()
+            if self._backward is None:
+                size = len(self.passable)
+                self._backward = ([0] * size, [0] * size, [0] * size)
+            path = self._search_bidirectional(self.cell_index(*start), self.cell_index(*goal))
+        if path is None:
+            return None
+        return [self.cell_at(index) for index in path]
+
+    def _search_bidirectional(self, start, goal):
+        # A* from the start over forward edges and from the goal over
+        # reversed edges (a closed start cell can be left but not entered),
+        # always growing the smaller frontier. Both sides share the average
+        # potential p(v) = (to_goal(v) - from_start(v)) / 2 built from the
+        # landmark bounds, kept doubled here so it stays an integer. The
+        # forward side orders by g + p and the backward side by g - p; as
+        # the landmark bounds are consistent, both are Dijkstra on the same
+        # non-negative reduced costs. Once the two cheapest open keys
+        # together reach the best meeting found, no shorter route exists.
+        # Cells with no bound lie on no route and are never queued.
+        if start == goal:
+            return [start]
+        if not self.passable[goal]:
+            return None
+        to_goal = self._landmark_bound(goal)
+        from_start = self._landmark_bound(start, reverse=True)
+        potentials = {}
+
+        def potential(cell):
+            if cell not in potentials:
+                ahead = to_goal(cell)
+                behind = from_start(cell)
+                potentials[cell] = None if ahead is None or behind is None else ahead - behind
+            return potentials[cell]
+
+        if potential(start) is None or potential(goal) is None:
+            return None
+        passable = self.passable
+        back_g_score, came_back, back_seen = self._backward
+        sides = (
+            (self.g_score, self.came_from, self.seen, [(potential(start), 0, start)], back_g_score, back_seen, 1),
+            (back_g_score, came_back, back_seen, [(-potential(goal), 0, goal)], self.g_score, self.seen, -1),
+        )
+
+        self.generation += 1
+        generation = self.generation
+        for (g_score, came_from, seen, open_set, _, _, _) in sides:
+            origin = open_set[0][2]
+            g_score[origin] = 0
+            came_from[origin] = -1
+            seen[origin] = generation
+        forward_open, backward_open = sides[0][3], sides[1][3]
+        best = None
+        meeting = None
+        expanded = 0
+
+        while forward_open and backward_open:
+            if best is not None and forward_open[0][0] + backward_open[0][0] >= 2 * best:
+                break
+            is_forward = len(forward_open) <= len(backward_open)
+            g_score, came_from, seen, open_set, other_g_score, other_seen, sign = sides[0 if is_forward else 1]
+            _, cost, current = heapq.heappop(open_set)
+            if cost > g_score[current]:
+                continue
+            expanded += 1
+            if not is_forward and not passable[current] and current != goal:
+                continue
+
+            candidates = self.neighbors(current)
+            if is_forward:
+                candidates.extend(self.stairs.get(current, ()))
+            else:
+                candidates.extend(self.stairs_into.get(current, ()))
+            new_cost = cost + 1
+            for neighbor in candidates:
+                # Forward steps must land on an open cell; backward steps
+                # may only come from one, or from the start itself.
+                if not passable[neighbor] and (is_forward or neighbor != start):
+                    continue
+                if seen[neighbor] != generation or new_cost < g_score[neighbor]:
+                    neighbor_potential = potential(neighbor)
+                    if neighbor_potential is None:
+                        continue
+                    seen[neighbor] = generation
+                    g_score[neighbor] = new_cost
+                    came_from[neighbor] = current
+                    heapq.heappush(open_set, (2 * new_cost + sign * neighbor_potential, new_cost, neighbor))
+                    if other_seen[neighbor] == generation:
+                        total = new_cost + other_g_score[neighbor]
+                        if best is None or total < best:
+                            best, meeting = total, neighbor
+
+        self.expanded = expanded
+        if meeting is None:
+            return None
+        path = self._reconstruct_path(meeting)
+        current = meeting
+        while came_back[current] != -1:
+            current = came_back[current]
+            path.append(current)
+        return path
+
+    def find_routes_from(self, start, goals):
+        with self._lock:
+            paths = self._search_many(self.cell_index(*start), {self.cell_index(*goal) for goal in goals})
+        routes = []
+        for goal in goals:
+            path = paths.get(self.cell_index(*goal))
+            routes.append(None if path is None else [self.cell_at(index) for index in path])
+        return routes
+
+    def _search_many(self, start, goals):
+        # One breadth-first search from start that stops as soon as every
+        # goal has been reached. Every step costs 1, so the first time a
+        # cell is reached is along a shortest path.
+        passable = self.passable
+        stairs = self.stairs
+        came_from = self.came_from
+        seen = self.seen
+
+        self.generation += 1
+        generation = self.generation
+        seen[start] = generation
+        came_from[start] = -1
+        remaining = set(goals)
+        remaining.discard(start)
+        queue = deque([start])
+        expanded = 0
+
+        while queue and remaining:
+            current = queue.popleft()
+            expanded += 1
+            candidates = self.neighbors(current)
+            candidates.extend(stairs.get(current, ()))
+            for neighbor in candidates:
+                if passable[neighbor] and seen[neighbor] != generation:
+                    seen[neighbor] = generation
+                    came_from[neighbor] = current
+                    remaining.discard(neighbor)
+                    queue.append(neighbor)
+
+        self.expanded = expanded
+        return {goal: self._reconstruct_path(goal) for goal in goals if seen[goal] == generation}
+
+    def _search(self, start, goal, use_landmarks=False, vertical_cost=VERTICAL_COST):
+        height = self.height
+        width = self.width
+        floor_cells = self.floor_cells
+        passable = self.passable
+        stairs = self.stairs
+        g_score = self.g_score
+        came_from = self.came_from
+        seen = self.seen
+        closed = self.closed
+
+        self.generation += 1
+        generation = self.generation
+        goal_floor, rest = divmod(goal, floor_cells)
+        goal_x, goal_y = divmod(rest, width)
+        if use_landmarks:
+            landmark_bound = self._landmark_bound(goal)
+
+        g_score[start] = 0
+        seen[start] = generation
+        came_from[start] = -1
+        open_set = [(0, start)]
+        expanded = 0
+
+        while open_set:
+            _, current = heapq.heappop(open_set)
+            if current == goal:
+                self.expanded = expanded
+                return self._reconstruct_path(current)
+            if closed[current] == generation:
+                continue
+            closed[current] = generation
+            expanded += 1
+
+            floor, rest = divmod(current, floor_cells)
+            x, y = divmod(rest, width)
+            tentative_g_score = g_score[current] + 1
+            # Same neighbour order as the original tuple-based search:
+            # down, up, left, right, then the stair link.
+            candidates = []
+            if x + 1 < height:
+                candidates.append(current + width)
+            if x > 0:
+                candidates.append(current - width)
+            if y > 0:
+                candidates.append(current - 1)
+            if y + 1 < width:
+                candidates.append(current + 1)
+            candidates.extend(stairs.get(current, ()))
+            for neighbor in candidates:
+                if not passable[neighbor]:
+                    continue
+                if seen[neighbor] != generation or tentative_g_score < g_score[neighbor]:
+                    seen[neighbor] = generation
+                    g_score[neighbor] = tentative_g_score
+                    came_from[neighbor] = current
+                    closed[neighbor] = 0
+                    if use_landmarks:
+                        estimate = landmark_bound(neighbor)
+                        if estimate is None:
+                            continue
+                    else:
+                        n_floor, n_rest = divmod(neighbor, floor_cells)
+                        n_x, n_y = divmod(n_rest, width)
+                        estimate = abs(n_x - goal_x) + abs(n_y - goal_y) + abs(n_floor - goal_floor) * vertical_cost
+                    heapq.heappush(open_set, (tentative_g_score + estimate, neighbor))
+
+        self.expanded = expanded
+        return None
+
+    def landmark_bound(self, goal):
+        with self._lock:
+            if self.landmarks is None:
+                self._select_landmarks()
+        return self._landmark_bound(goal)
+
+    def _landmark_bound(self, goal, reverse=False):
+        # Triangle-inequality lower bounds on the distance to the goal:
+        #   d(v, goal) >= d(L, goal) - d(L, v)
+        #   d(v, goal) >= d(v, L) - d(goal, L)
+        # A closed cell can be left but not entered, so distances from and
+        # to each landmark are kept separately. None means the goal cannot
+        # be reached from v at all. With reverse the bound is on d(goal, v)
+        # instead, which swaps the roles of the two distance arrays.
+        landmarks = [
+            (from_landmark, from_landmark[goal], to_landmark, to_landmark[goal])
+            for from_landmark, to_landmark in (
+                [pair[::-1] for pair in self.landmarks] if reverse else self.landmarks)
+        ]
+
+        def bound(cell):
+            best = 0
+            for from_landmark, from_goal, to_landmark, to_goal in landmarks:
+                from_cell = from_landmark[cell]
+                if from_cell != UNREACHABLE:
+                    if from_goal == UNREACHABLE:
+                        return None
+                    best = max(best, from_goal - from_cell)
+                to_cell = to_landmark[cell]
+                if to_goal != UNREACHABLE:
+                    if to_cell == UNREACHABLE:
+                        return None
+                    best = max(best, to_cell - to_goal)
+            return best
+
+        return bound
+
+    def _select_landmarks(self):
+        # Farthest-first over the open cells of the main part of the
+        # building: the first landmark is the cell farthest from where the
+        # main part was found, which puts it on the edge, and each next pick
+        # is the cell farthest from all landmarks so far. Walled-off pockets
+        # get none; a search inside one ends at once anyway.
+        passable = self.passable
+        open_cells = [i for i, cell in enumerate(passable) if cell]
+        landmarks = []
+        seed, largest = None, 0
+        seen = bytearray(len(passable))
+        for cell in open_cells:
+            if seen[cell]:
+                continue
+            seen[cell] = 1
+            reached = [cell]
+            for current in reached:
+                for neighbor in self.neighbors(current) + self.stairs.get(current, []):
+                    if passable[neighbor] and not seen[neighbor]:
+                        seen[neighbor] = 1
+                        reached.append(neighbor)
+            if len(reached) > largest:
+                seed, largest = cell, len(reached)
+            if 2 * largest > len(open_cells):
+                break
+        if seed is None:
+            self.landmarks = landmarks
+            return
+        from_seed = self._distances(seed, reverse=False)
+        candidates = [cell for cell in open_cells if from_seed[cell] != UNREACHABLE]
+        choice = max(candidates, key=from_seed.__getitem__)
+        nearest = [math.inf] * len(self.passable)
+        while nearest[choice] > 0 and len(landmarks) < NUM_LANDMARKS:
+            from_landmark = self._distances(choice, reverse=False)
+            to_landmark = self._distances(choice, reverse=True)
+            landmarks.append((from_landmark, to_landmark))
+            nearest[choice] = 0
+            for cell, distance in enumerate(from_landmark):
+                if distance != UNREACHABLE and distance < nearest[cell]:
+                    nearest[cell] = distance
+            choice = max(candidates, key=nearest.__getitem__)
+        self.landmarks = landmarks
+
+    def _distances(self, source, reverse):
+        passable = self.passable
+        stairs = self.stairs_into if reverse else self.stairs
+
+        distance = [UNREACHABLE] * len(passable)
+        distance[source] = 0
+        queue = deque([source])
+        while queue:
+            current = queue.popleft()
+            if reverse and not passable[current] and current != source:
+                continue
+            candidates = self.neighbors(current)
+            candidates.extend(stairs.get(current, ()))
+            for neighbor in candidates:
+                if distance[neighbor] != UNREACHABLE:
+                    continue
+                if not reverse and not passable[neighbor]:
+                    continue
+                distance[neighbor] = distance[current] + 1
+                queue.append(neighbor)
+        return distance
+
+    def _reconstruct_path(self, current):
+        came_from = self.came_from
+        path = [current]
+        while came_from[current] != -1:
+            current = came_from[current]
+            path.append(current)
+        return path[::-1]
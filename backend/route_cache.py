@@ -0,0 +1,68 @@
+import os
+import threading
+from collections import OrderedDict
+
+ROUTE_CACHE_SIZE = int(os.environ.get("ROUTE_CACHE_SIZE", "256"))
+
+
+class RouteCache:
+    def __init__(self, max_size=ROUTE_CACHE_SIZE):
+        self.max_size = max_size
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._routes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _check_version(self, version):
+        # Every entry was computed against one map version; a newer version
+        # makes all of them stale at once. Versions only grow, so a request
+        # still finishing on an older map is simply not cached.
+        if self.version is not None and version < self.version:
+            return False
+        if version != self.version:
+            if self._routes:
+                self.invalidations += 1
+                self._routes.clear()
+            self.version = version
+        return True
+
+    def get(self, key, version):
+        with self._lock:
+            route = self._routes.get(key) if self._check_version(version) else None
+            if route is None:
+                self.misses += 1
+                return None
+            self._routes.move_to_end(key)
+            self.hits += 1
+            return route
+
+    def put(self, key, version, route):
+        with self._lock:
+            if not self._check_version(version):
+                return
+            self._routes[key] = route
+            self._routes.move_to_end(key)
+            while len(self._routes) > self.max_size:
+                self._routes.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._routes.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._routes),
+                "max_size": self.max_size,
+                "version": self.version,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
@@ -0,0 +1,73 @@
+import struct
+
+ROUTE_FORMATS = ('cells', 'runs', 'binary', 'instructions')
+RUNS_MEDIA_TYPE = "application/vnd.route-runs+json"
+INSTRUCTIONS_MEDIA_TYPE = "application/vnd.route-instructions+json"
+BINARY_MEDIA_TYPE = "application/octet-stream"
+
+# Row numbers grow southwards and column numbers eastwards, as the map is
+# printed.
+DIRECTIONS = {(1, 0): 'S', (-1, 0): 'N', (0, 1): 'E', (0, -1): 'W'}
+STEPS = {direction: step for step, direction in DIRECTIONS.items()}
+BINARY_COUNT = struct.Struct("<I")
+
+
+def choose_format(requested, accept):
+    # An explicit ?format= wins; otherwise the Accept header may ask for a
+    # compact form. Anything else gets the original list of cells.
+    if requested is not None:
+        if requested not in ROUTE_FORMATS:
+            raise ValueError("Unknown route format")
+        return requested
+    if accept:
+        if RUNS_MEDIA_TYPE in accept:
+            return 'runs'
+        if INSTRUCTIONS_MEDIA_TYPE in accept:
+            return 'instructions'
+        if BINARY_MEDIA_TYPE in accept:
+            return 'binary'
+    return 'cells'
+
+
+def encode_runs(route):
+    # {"start": cell, "steps": [...]}, where each step is [direction, count]
+    # for a straight run on one floor, or ["stairs", floor, x, y] for a
+    # stair link to that cell.
+    if not route:
+        return {"start": None, "steps": [], "length": 0}
+    steps = []
+    for (floor, x, y), (next_floor, next_x, next_y) in zip(route, route[1:]):
+        direction = DIRECTIONS.get((next_x - x, next_y - y)) if floor == next_floor else None
+        if direction is None:
+            steps.append(["stairs", next_floor, next_x, next_y])
+        elif steps and steps[-1][0] == direction:
+            steps[-1][1] += 1
+        else:
+            steps.append([direction, 1])
+    return {"start": list(route[0]), "steps": steps, "length": len(route) - 1}
+
+
+def decode_runs(encoded):
+    if encoded["start"] is None:
+        return []
+    route = [tuple(encoded["start"])]
+    for step in encoded["steps"]:
+        if step[0] == "stairs":
+            route.append(tuple(step[1:]))
+            continue
+        dx, dy = STEPS[step[0]]
+        floor, x, y = route[-1]
+        for i in range(1, step[1] + 1):
+            route.append((floor, x + dx * i, y + dy * i))
+    return route
+
+
+def encode_binary(route):
+    # Little-endian uint32 cell count, then floor, x, y as uint16 per cell.
+    return BINARY_COUNT.pack(len(route)) + struct.pack(f"<{3 * len(route)}H", *(v for cell in route for v in cell))
+
+
+def decode_binary(data):
+    (count,) = BINARY_COUNT.unpack_from(data, 0)
+    values = struct.unpack_from(f"<{3 * count}H", data, BINARY_COUNT.size)
+    return [values[i:i + 3] for i in range(0, len(values), 3)]
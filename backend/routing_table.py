@@ -0,0 +1,158 @@
+import os
+import threading
+from array import array
+from collections import OrderedDict, deque
+
+UNREACHABLE = -1
+# Trees each routing table keeps, for the rooms asked about most recently.
+# Every tree is two int arrays over every cell of the map.
+DESTINATION_TREES = int(os.environ.get("DESTINATION_TREES", "64"))
+
+
+class RoutingTable:
+    def __init__(self, map_obj, max_trees=DESTINATION_TREES):
+        self.map = map_obj
+        self.version = map_obj.version
+        self.max_trees = max_trees
+        self.rooms = {room_name: map_obj.cell_index(*cell) for room_name, cell in map_obj.room_cells()}
+        self._trees = OrderedDict()
+        self._lock = threading.Lock()
+
+    def tree(self, room_name):
+        # (next_hop, distance) towards one room, grown the first time the
+        # room is asked for. A room-to-room route, or one back from wherever
+        # a walker has strayed, is then a walk down the tree.
+        with self._lock:
+            tree = self._trees.get(room_name)
+            if tree is not None:
+                self._trees.move_to_end(room_name)
+                return tree
+        # Built outside the lock so that requests for the rooms already
+        # held are not kept waiting; two threads may both build one tree.
+        tree = self._build_tree(self.rooms[room_name])
+        with self._lock:
+            self._trees[room_name] = tree
+            while len(self._trees) > self.max_trees:
+                self._trees.popitem(last=False)
+        return tree
+
+    def renew(self, map_obj):
+        # An empty table of the same kind for a copy of the map with a cell
+        # closed or opened; see keep_trees.
+        return RoutingTable(map_obj, self.max_trees)
+
+    def keep_trees(self, table, index, block):
+        # Takes over the trees of table, built before flat cell index was
+        # closed (block) or opened, that the change leaves as they were.
+        # Closing a cell changes a tree only if some neighbour's next hop
+        # is that cell. Opening one changes it only if the way out of the
+        # cell gives a neighbour a shorter way to the room.
+        engine = self.map.search_engine()
+        ways = [(neighbor, 1) for neighbor in engine.neighbors(index)]
+        ways.extend(self._links_from(engine, index))
+        # Walls never get a distance; blocked cells do, once they have a
+        # way out.
+        ways = [(cell, step) for cell, step in ways
+                if engine.passable[cell] or engine.cell_at(cell) in self.map.blocked]
+        with table._lock:
+            trees = list(table._trees.items())
+        for room_name, (next_hop, distance) in trees:
+            if self.rooms[room_name] == index:
+                continue
+            if block:
+                unchanged = all(next_hop[cell] != index for cell, _ in ways)
+            else:
+                here = distance[index]
+                unchanged = here == UNREACHABLE or all(
+                    distance[cell] != UNREACHABLE and distance[cell] <= here + step for cell, step in ways)
+            if unchanged:
+                self._trees[room_name] = (next_hop, distance)
+
+    def max_bytes(self):
+        # The most the trees held at once can take.
+        return min(len(self.rooms), self.max_trees) * 2 * self.map.num_cells * array('i').itemsize
+
+    def _build_tree(self, root):
+        # Breadth-first search backwards from the room's flat cell over the
+        # search engine's arrays. Every cell reached records the neighbour
+        # it was reached from, which is its next hop on a shortest path to
+        # the room. Links are followed from their far end.
+        engine = self.map.search_engine()
+        passable = engine.passable
+        stairs_into = engine.stairs_into
+        next_hop = array('i', [UNREACHABLE]) * len(passable)
+        distance = array('i', [UNREACHABLE]) * len(passable)
+        if not passable[root]:
+            # A closed room cannot be walked into from anywhere.
+            return next_hop, distance
+        next_hop[root] = root
+        distance[root] = 0
+        queue = deque([root])
+        while queue:
+            current = queue.popleft()
+            step = distance[current] + 1
+            candidates = engine.neighbors(current)
+            candidates.extend(stairs_into.get(current, ()))
+            for neighbor in candidates:
+                if passable[neighbor] and distance[neighbor] == UNREACHABLE:
+                    distance[neighbor] = step
+                    next_hop[neighbor] = current
+                    queue.append(neighbor)
+        self._leave_blocked(engine, next_hop, distance)
+        return next_hop, distance
+
+    def _leave_blocked(self, engine, next_hop, distance):
+        # A blocked cell can be left but not entered, as in the searches,
+        # so someone standing in one is sent out the cheapest way.
+        exits = {}
+        for cell in self.map.blocked:
+            index = engine.cell_index(*cell)
+            best = None
+            for exit_index in engine.neighbors(index):
+                best = self._better_exit(best, exit_index, 1, distance)
+            for exit_index, step in self._links_from(engine, index):
+                best = self._better_exit(best, exit_index, step, distance)
+            if best is not None:
+                exits[index] = best
+        # Filled in last, so no way out leads through another blocked cell.
+        for index, (exit_distance, exit_index) in exits.items():
+            distance[index] = exit_distance
+            next_hop[index] = exit_index
+
+    def _better_exit(self, best, exit_index, step, distance):
+        if distance[exit_index] == UNREACHABLE:
+            return best
+        if best is None or distance[exit_index] + step < best[0]:
+            return distance[exit_index] + step, exit_index
+        return best
+
+    def _links_from(self, engine, index):
+        for dest in engine.stairs.get(index, ()):
+            yield dest, 1
+
+    def __contains__(self, room_name):
+        return room_name in self.rooms
+
+    def route_distance(self, start_room, end_room):
+        distance = self.tree(end_room)[1][self.rooms[start_room]]
+        return None if distance == UNREACHABLE else distance
+
+    def distance_from_cell(self, start, end_room):
+        distance = self.tree(end_room)[1][self.map.cell_index(*start)]
+        return None if distance == UNREACHABLE else distance
+
+    def route(self, start_room, end_room):
+        return self.route_from_cell(self.map.cell_at(self.rooms[start_room]), end_room)
+
+    def route_from_cell(self, start, end_room):
+        next_hop = self.tree(end_room)[0]
+        goal = self.rooms[end_room]
+        current = self.map.cell_index(*start)
+        if next_hop[current] == UNREACHABLE:
+            return None
+
+        path = [self.map.cell_at(current)]
+        while current != goal:
+            current = next_hop[current]
+            path.append(self.map.cell_at(current))
+        return path
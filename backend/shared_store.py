@@ -0,0 +1,220 @@
+import hashlib
+import json
+import mmap
+import os
+import shutil
+import struct
+import sys
+import threading
+from array import array
+from contextlib import contextmanager
+
+from connectors import ProfileTable
+from routing_table import RoutingTable
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Each tree of a routing table is one file, in a directory for the map and
+# profile it was built from, named after its room's flat cell. Layout, in
+# native byte order (recorded in the header):
+#   header   magic, format version, byte order, floors, height, width,
+#            the room's flat cell, then the SHA-256 digest of the map and
+#            routing profile
+#   tree     next_hop then distance, each one int32 per flat cell
+MAGIC = b"NAVS"
+FORMAT_VERSION = 3
+HEADER = struct.Struct("<4sHHIIII32s")
+BYTE_ORDER = {"little": 1, "big": 2}[sys.byteorder]
+CELL_BYTES = array('i').itemsize
+
+
+def map_digest(map_obj, profile='default'):
+    digest = hashlib.sha256()
+    digest.update(profile.encode("utf-8") + b"\0")
+    digest.update(struct.pack("<III", map_obj.num_floors, map_obj.height, map_obj.width))
+    digest.update("\0".join(map_obj.cell_names[1:]).encode("utf-8") + b"\1")
+    for passable, cell_ids in zip(map_obj.floor_passable, map_obj.floor_cell_ids):
+        if passable is not None:
+            digest.update(passable)
+            digest.update(cell_ids.tobytes())
+        digest.update(b"\2")
+    for source, dests in sorted(map_obj.stairs.items()):
+        for dest in sorted(dests):
+            digest.update(struct.pack("<6i", *source, *dest))
+    for connector in map_obj.connectors:
+        digest.update(connector.kind.encode("utf-8") + b"\0")
+        digest.update(struct.pack("<7i", *connector.source, *connector.dest, connector.cost))
+    # A blocked cell reads as a wall but still belongs to its room, and
+    # the tables send anyone standing in it out again.
+    for cell, original in sorted(map_obj.blocked.items()):
+        digest.update(struct.pack("<3i", *cell) + original.encode("utf-8") + b"\0")
+    return digest.digest()
+
+
+def store_name(map_path):
+    # What a map file's entries in the store directory are named after:
+    # its base name for people reading the directory, then a hash of its
+    # full path, as buildings on a campus often share a file name.
+    name = os.path.splitext(os.path.basename(map_path))[0]
+    full_path = os.path.realpath(map_path).encode("utf-8", "surrogateescape")
+    return f"{name}-{hashlib.sha256(full_path).hexdigest()[:8]}"
+
+
+def store_path(store_dir, map_path, map_obj, profile='default'):
+    return os.path.join(store_dir, f"{store_name(map_path)}.{profile}.{map_digest(map_obj, profile).hex()[:16]}")
+
+
+class SharedRoutingTable(RoutingTable):
+    # One profile's routing table whose trees are shared between processes
+    # through memory-mapped files in path, a directory for this exact map
+    # and profile. The first process to need a tree builds it and writes
+    # it there; the others map what it wrote.
+    def __init__(self, path, map_obj, profile='default', store_dir=None, map_path=None):
+        super().__init__(map_obj)
+        self.profile = profile
+        self.path = path
+        self.store_dir = store_dir
+        self.map_path = map_path
+        self._digest = map_digest(map_obj, profile)
+        self._builder = _build_table(map_obj, profile)
+
+    def renew(self, map_obj):
+        return load_routing_table(self.store_dir, self.map_path, map_obj, self.profile)
+
+    def _build_tree(self, root):
+        tree_path = os.path.join(self.path, f"{root}.tree")
+        try:
+            return self._map_tree(tree_path, root)
+        except (OSError, ValueError):
+            pass
+        tree = self._builder._build_tree(root)
+        try:
+            write_tree(tree_path, self.map, root, tree, self._digest)
+        except OSError:
+            # A newer map has replaced this one and its directory is gone;
+            # the tree is still good for this process.
+            pass
+        return tree
+
+    def _map_tree(self, tree_path, root):
+        map_obj = self.map
+        with open(tree_path, "rb") as f:
+            data = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        magic, format_version, byte_order, num_floors, height, width, cell, digest = HEADER.unpack_from(data, 0)
+        if magic != MAGIC or format_version != FORMAT_VERSION or byte_order != BYTE_ORDER:
+            raise ValueError("Not a store file for this build")
+        if (num_floors, height, width, cell) != (map_obj.num_floors, map_obj.height, map_obj.width, root) \
+                or digest != self._digest:
+            raise ValueError("Store file was built from a different map")
+        table_bytes = map_obj.num_cells * CELL_BYTES
+        if len(data) != HEADER.size + 2 * table_bytes:
+            raise ValueError("Store file is truncated")
+        # The views keep the mapping open for as long as the tree is held.
+        next_hop = data[HEADER.size:HEADER.size + table_bytes].cast('i')
+        return next_hop, data[HEADER.size + table_bytes:].cast('i')
+
+
+def write_tree(path, map_obj, root, tree, digest):
+    # Written under a temporary name and renamed into place, so a reader
+    # never maps a half-written file. Two processes building the same tree
+    # write the same bytes.
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, BYTE_ORDER, map_obj.num_floors, map_obj.height,
+                            map_obj.width, root, digest))
+        for values in tree:
+            values.tofile(f)
+    os.replace(temp_path, path)
+
+
+def _remove_stale(store_dir, map_path, path, profile):
+    # Older builds of the same map file and profile are no longer wanted.
+    # Processes that still have trees mapped keep their pages until they
+    # let go.
+    prefix = f"{store_name(map_path)}.{profile}."
+    for entry in os.listdir(store_dir):
+        digest = entry[len(prefix):].removesuffix(".navstore")
+        if not entry.startswith(prefix) or len(digest) != 16 or entry == os.path.basename(path):
+            continue
+        stale = os.path.join(store_dir, entry)
+        try:
+            if os.path.isdir(stale):
+                shutil.rmtree(stale)
+            else:
+                os.remove(stale)
+        except OSError:
+            pass
+
+
+def _build_table(map_obj, profile):
+    if profile == 'default':
+        return RoutingTable(map_obj)
+    return ProfileTable(map_obj, profile)
+
+
+@contextmanager
+def _store_lock(store_dir):
+    os.makedirs(store_dir, exist_ok=True)
+    with open(os.path.join(store_dir, ".lock"), "a+b") as lock:
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+
+def load_routing_table(store_dir, map_path, map_obj, profile='default'):
+    # The shared table for this exact map and profile. Its trees are
+    # built as rooms are asked for, so opening it costs no searches; the
+    # first process to see a new map makes its directory and clears out
+    # the ones for older builds.
+    path = store_path(store_dir, map_path, map_obj, profile)
+    try:
+        if not os.path.isdir(path):
+            with _store_lock(store_dir):
+                os.makedirs(path, exist_ok=True)
+                _remove_stale(store_dir, map_path, path, profile)
+        return SharedRoutingTable(path, map_obj, profile, store_dir, map_path)
+    except OSError as e:
+        print(f"Shared map store in {store_dir} unavailable, building tables in memory: {e}")
+        return _build_table(map_obj, profile)
+
+
+def blocked_path(store_dir, map_path):
+    return os.path.join(store_dir, f"{store_name(map_path)}.blocked.json")
+
+
+def read_blocked(store_dir, map_path):
+    # The cells closed at runtime by any worker, as a list of [floor, x, y]
+    # in the store directory. None when it cannot be read, and the caller
+    # keeps the cells it has.
+    try:
+        with open(blocked_path(store_dir, map_path), encoding="utf-8") as f:
+            cells = json.load(f)
+    except FileNotFoundError:
+        return frozenset()
+    except (OSError, ValueError):
+        return None
+    if not isinstance(cells, list) or not all(
+            isinstance(cell, list) and len(cell) == 3 and all(isinstance(v, int) for v in cell) for cell in cells):
+        return None
+    return frozenset(tuple(cell) for cell in cells)
+
+
+def update_blocked(store_dir, map_path, cell, block):
+    # Closes or reopens one cell for every worker and returns the cells now
+    # closed, or None if the store directory cannot be written.
+    try:
+        with _store_lock(store_dir):
+            cells = read_blocked(store_dir, map_path) or frozenset()
+            cells = cells | {cell} if block else cells - {cell}
+            path = blocked_path(store_dir, map_path)
+            temp_path = f"{path}.{os.getpid()}.tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(sorted(cells), f)
+            os.replace(temp_path, path)
+            return cells
+    except OSError as e:
+        print(f"Shared map store in {store_dir} unavailable, blocking cells in this worker only: {e}")
+        return None
@@ -0,0 +1,66 @@
+import os
+import random
+import sys
+from collections import deque
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from map_model import Map  # noqa: E402
+
+
+def random_map(seed, num_floors=2, height=12, width=12, walls=0.3, links=3, rooms=0):
+    # A grid with random walls, connectors between open cells that may move
+    # across the floor plan and, if asked for, single-cell rooms named R0,
+    # R1, ... on other open cells.
+    rng = random.Random(seed)
+    floors = [[['X' if rng.random() < walls else '.' for _ in range(width)] for _ in range(height)]
+              for _ in range(num_floors)]
+    open_cells = [(floor, x, y) for floor in range(num_floors) for x in range(height) for y in range(width)
+                  if floors[floor][x][y] == '.']
+    rng.shuffle(open_cells)
+    for i, (floor, x, y) in enumerate(open_cells[:rooms]):
+        floors[floor][x][y] = f"R{i}"
+    map_obj = Map(floors)
+    ends = open_cells[rooms:]
+    for _ in range(links if num_floors > 1 else 0):
+        source, dest = rng.sample(ends, 2)
+        if source[0] != dest[0]:
+            map_obj.add_connector(rng.choice(('stairs', 'lift', 'ramp')), *source, *dest)
+    return map_obj
+
+
+def shortest_distance(map_obj, start, goal):
+    # Breadth-first search over the map itself: a step goes to an open cell
+    # beside this one or at the far end of a stair link. The start may be
+    # closed, as it can still be left. None when the goal cannot be reached.
+    distance = {start: 0}
+    queue = deque([start])
+    while queue:
+        current = queue.popleft()
+        if current == goal:
+            return distance[current]
+        floor, x, y = current
+        steps = [(floor, x + 1, y), (floor, x - 1, y), (floor, x, y - 1), (floor, x, y + 1)]
+        steps.extend(map_obj.stairs.get(current, ()))
+        for step in steps:
+            if step not in distance and map_obj.in_bounds(*step) and map_obj.is_open(*step):
+                distance[step] = distance[current] + 1
+                queue.append(step)
+    return None
+
+
+def is_walk(map_obj, route):
+    # Every step of the route is to an open cell beside the last one or
+    # along a stair link from it.
+    for (floor, x, y), step in zip(route, route[1:]):
+        beside = step[0] == floor and abs(step[1] - x) + abs(step[2] - y) == 1
+        if not (beside or step in map_obj.stairs.get((floor, x, y), ())) or not map_obj.is_open(*step):
+            return False
+    return True
+
+
+@pytest.fixture(params=range(8))
+def seed(request):
+    return request.param
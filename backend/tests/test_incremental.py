@@ -0,0 +1,115 @@
+import random
+
+from conftest import is_walk, random_map, shortest_distance
+from incremental import IncrementalPlanner, NavigationSessions
+
+
+def check_plan(map_obj, planner, goal):
+    start = planner.cell_at(planner.start)
+    distance = shortest_distance(map_obj, start, goal)
+    route = planner.route()
+    if distance is None:
+        assert route is None
+        return route
+    assert route is not None
+    assert route[0] == start and route[-1] == goal
+    assert is_walk(map_obj, route)
+    assert len(route) - 1 == distance
+    return route
+
+
+def cells(map_obj):
+    return [(floor, x, y) for floor in range(map_obj.num_floors)
+            for x in range(map_obj.floor_dims[floor][0]) for y in range(map_obj.floor_dims[floor][1])]
+
+
+def change_cell(map_obj, rng):
+    # The map with a random cell closed, or a closed one opened again, as
+    # a walker would meet them: (map, changed cell), or None for no change.
+    if map_obj.blocked and rng.random() < 0.4:
+        cell, block = rng.choice(sorted(map_obj.blocked)), False
+    else:
+        cell, block = rng.choice(cells(map_obj)), True
+    changed = map_obj.with_cell(*cell, block)
+    return None if changed is None else (changed, cell)
+
+
+def test_repair_matches_a_fresh_search(seed):
+    rng = random.Random(seed)
+    map_obj = random_map(seed, num_floors=2, height=10, width=12, walls=0.2, links=4)
+    start, goal = rng.sample([cell for cell in cells(map_obj) if map_obj.is_open(*cell)], 2)
+    planner = IncrementalPlanner(map_obj, start, goal)
+    check_plan(map_obj, planner, goal)
+
+    for _ in range(60):
+        change = change_cell(map_obj, rng)
+        if change is None:
+            continue
+        map_obj, cell = change
+        planner.map_obj = map_obj
+        planner.update_cells([cell])
+        route = check_plan(map_obj, planner, goal)
+        if route and len(route) > 1 and rng.random() < 0.5:
+            # Walk a few steps along the plan before the next change.
+            planner.move_to(*route[min(len(route) - 1, rng.randint(1, 3))])
+            check_plan(map_obj, planner, goal)
+
+
+def test_repair_after_the_walker_is_shut_in(seed):
+    # The walker's own cell closes around them: they can still step out,
+    # and the plan has to say so.
+    rng = random.Random(seed)
+    map_obj = random_map(seed, num_floors=1, height=8, width=8, walls=0.1)
+    start, goal = rng.sample([cell for cell in cells(map_obj) if map_obj.is_open(*cell)], 2)
+    planner = IncrementalPlanner(map_obj, start, goal)
+    map_obj = planner.map_obj = map_obj.with_cell(*start, True)
+    planner.update_cells([start])
+    check_plan(map_obj, planner, goal)
+
+
+def test_sessions_follow_cell_changes(seed):
+    rng = random.Random(seed)
+    map_obj = random_map(seed, num_floors=2, height=9, width=9, walls=0.2, links=3, rooms=4)
+    sessions = NavigationSessions()
+    goal_room = f"R{rng.randrange(4)}"
+    goal = map_obj.get_room_coordinates(goal_room)
+    start = rng.choice([cell for cell in cells(map_obj) if map_obj.is_open(*cell) and cell != goal])
+    session_id, _ = sessions.create(map_obj, start, goal_room)
+
+    for _ in range(30):
+        change = change_cell(map_obj, rng)
+        if change is None:
+            continue
+        if rng.random() < 0.5:
+            # Repaired straight away, as by the worker that made the change.
+            sessions.cells_changed(map_obj, change[0], [change[1]])
+        map_obj = change[0]
+        # Otherwise repaired when the session next asks for its route.
+        route = sessions.route(session_id, map_obj)
+        distance = shortest_distance(map_obj, start, goal)
+        assert (route is None) == (distance is None)
+        if route is not None:
+            assert route[0] == start and route[-1] == goal
+            assert is_walk(map_obj, route) and len(route) - 1 == distance
+
+
+def test_routing_table_after_cell_changes(seed):
+    # Trees carried over by Map.with_cell must agree with a fresh search.
+    # A closed room cannot be walked into, not even from itself.
+    rng = random.Random(seed)
+    map_obj = random_map(seed, num_floors=2, height=9, width=10, walls=0.2, links=3, rooms=5)
+    for _ in range(25):
+        table = map_obj.routing_table()
+        for room in table.rooms:
+            table.tree(room)
+        change = change_cell(map_obj, rng)
+        if change is None:
+            continue
+        map_obj = change[0]
+        table = map_obj.routing_table()
+        for start_room in table.rooms:
+            for end_room in table.rooms:
+                start = map_obj.get_room_coordinates(start_room)
+                goal = map_obj.get_room_coordinates(end_room)
+                distance = shortest_distance(map_obj, start, goal) if map_obj.is_open(*goal) else None
+                assert table.route_distance(start_room, end_room) == distance
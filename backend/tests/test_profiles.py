@@ -0,0 +1,86 @@
+import heapq
+
+import pytest
+
+from conftest import is_walk, random_map
+from connectors import PROFILES, connector_cost
+
+
+def link_costs(map_obj, profile):
+    # {(cell, cell): cost} for the connectors the profile may take, both
+    # ways, keeping the cheapest where two join the same cells.
+    costs = {}
+    for connector in map_obj.connectors:
+        cost = connector_cost(profile, connector)
+        if cost is None:
+            continue
+        for ends in ((connector.source, connector.dest), (connector.dest, connector.source)):
+            costs[ends] = min(cost, costs.get(ends, cost))
+    return costs
+
+
+def cheapest_walk(map_obj, profile, start, goal):
+    # Dijkstra over the map itself: one per step to an open cell beside
+    # this one, or the connector's cost for the profile to its far end.
+    links = {}
+    for (source, dest), cost in link_costs(map_obj, profile).items():
+        links.setdefault(source, []).append((dest, cost))
+    distance = {start: 0}
+    open_set = [(0, start)]
+    while open_set:
+        cost, current = heapq.heappop(open_set)
+        if current == goal:
+            return cost
+        if cost > distance[current]:
+            continue
+        floor, x, y = current
+        steps = [((floor, x + dx, y + dy), 1) for dx, dy in ((1, 0), (-1, 0), (0, -1), (0, 1))]
+        steps.extend(links.get(current, ()))
+        for step, step_cost in steps:
+            if not map_obj.in_bounds(*step) or not map_obj.is_open(*step):
+                continue
+            if step not in distance or cost + step_cost < distance[step]:
+                distance[step] = cost + step_cost
+                heapq.heappush(open_set, (cost + step_cost, step))
+    return None
+
+
+def walk_cost(map_obj, profile, route):
+    costs = link_costs(map_obj, profile)
+    total = 0
+    for cell, step in zip(route, route[1:]):
+        beside = cell[0] == step[0] and abs(cell[1] - step[1]) + abs(cell[2] - step[2]) == 1
+        total += 1 if beside else costs[(cell, step)]
+    return total
+
+
+@pytest.mark.parametrize("profile", PROFILES)
+def test_profile_table_matches_dijkstra(seed, profile):
+    map_obj = random_map(seed, num_floors=3, height=9, width=10, walls=0.25, links=6, rooms=6)
+    table = map_obj.profile_table(profile)
+    for start_room in table.rooms:
+        start = map_obj.get_room_coordinates(start_room)
+        for end_room in table.rooms:
+            goal = map_obj.get_room_coordinates(end_room)
+            distance = cheapest_walk(map_obj, profile, start, goal)
+            assert table.route_distance(start_room, end_room) == distance
+            route = table.route(start_room, end_room)
+            if distance is None:
+                assert route is None
+                continue
+            assert route[0] == start and route[-1] == goal
+            assert is_walk(map_obj, route)
+            assert walk_cost(map_obj, profile, route) == distance
+
+
+def test_step_free_never_takes_stairs(seed):
+    map_obj = random_map(seed, num_floors=3, height=9, width=10, walls=0.2, links=8, rooms=6)
+    stairs = {(connector.source, connector.dest) for connector in map_obj.connectors if connector.kind == 'stairs'}
+    stairs |= {(dest, source) for source, dest in stairs}
+    usable = set(link_costs(map_obj, 'step-free'))
+    table = map_obj.profile_table('step-free')
+    for start_room in table.rooms:
+        for end_room in table.rooms:
+            route = table.route(start_room, end_room) or []
+            for step in zip(route, route[1:]):
+                assert step not in stairs or step in usable
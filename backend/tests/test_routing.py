@@ -0,0 +1,85 @@
+import random
+
+import pytest
+
+from conftest import is_walk, random_map, shortest_distance
+from map_model import Map
+
+# Modes that always find a shortest route. astar weighs floor changes more
+# than a stair step costs, and corridor falls back to it for cells off its
+# graph, so those two are only shortest on a single floor. hierarchical
+# plans between cluster portals and is only held to a valid route.
+EXACT_MODES = ('alt', 'bidirectional')
+ONE_FLOOR_EXACT_MODES = EXACT_MODES + ('astar', 'corridor')
+
+
+def cells(map_obj):
+    return [(floor, x, y) for floor in range(map_obj.num_floors)
+            for x in range(map_obj.floor_dims[floor][0]) for y in range(map_obj.floor_dims[floor][1])]
+
+
+def query_pairs(map_obj, seed, count=60):
+    # Any two cells, walls included: a wall start can still be left and a
+    # wall goal must come back as no route.
+    rng = random.Random(seed)
+    every_cell = cells(map_obj)
+    return [(rng.choice(every_cell), rng.choice(every_cell)) for _ in range(count)]
+
+
+def check_route(map_obj, start, goal, route, exact):
+    distance = shortest_distance(map_obj, start, goal)
+    if distance is None:
+        assert route is None
+        return
+    assert route is not None
+    assert route[0] == start and route[-1] == goal
+    assert is_walk(map_obj, route)
+    if exact:
+        assert len(route) - 1 == distance
+    else:
+        assert len(route) - 1 >= distance
+
+
+@pytest.mark.parametrize("mode", Map.ROUTING_MODES)
+def test_every_mode_finds_a_route_when_one_exists(seed, mode):
+    map_obj = random_map(seed, num_floors=3, height=11, width=13, links=5)
+    for start, goal in query_pairs(map_obj, seed):
+        route = map_obj.find_route(*start, *goal, mode=mode)
+        check_route(map_obj, start, goal, route, mode in EXACT_MODES)
+
+
+@pytest.mark.parametrize("mode", Map.ROUTING_MODES)
+def test_modes_on_one_floor(seed, mode):
+    map_obj = random_map(seed, num_floors=1, height=15, width=11, walls=0.35)
+    for start, goal in query_pairs(map_obj, seed):
+        route = map_obj.find_route(*start, *goal, mode=mode)
+        check_route(map_obj, start, goal, route, mode in ONE_FLOOR_EXACT_MODES)
+
+
+def test_find_routes_is_shortest_to_every_goal(seed):
+    map_obj = random_map(seed, num_floors=2, height=12, width=12, links=4)
+    rng = random.Random(seed)
+    every_cell = cells(map_obj)
+    for _ in range(10):
+        start = rng.choice(every_cell)
+        goals = [rng.choice(every_cell) for _ in range(8)]
+        for goal, route in zip(goals, map_obj.find_routes(start, goals)):
+            check_route(map_obj, start, goal, route, exact=True)
+
+
+def test_routing_table_matches_breadth_first_search(seed):
+    map_obj = random_map(seed, num_floors=2, height=10, width=10, links=3, rooms=6)
+    table = map_obj.routing_table()
+    for start_room in table.rooms:
+        for end_room in table.rooms:
+            start = map_obj.get_room_coordinates(start_room)
+            goal = map_obj.get_room_coordinates(end_room)
+            assert table.route_distance(start_room, end_room) == shortest_distance(map_obj, start, goal)
+            route = table.route(start_room, end_room)
+            check_route(map_obj, start, goal, route, exact=True)
+
+
+def test_unknown_mode_is_rejected():
+    map_obj = random_map(0)
+    with pytest.raises(ValueError):
+        map_obj.find_route(0, 0, 0, 0, 1, 1, mode='teleport')
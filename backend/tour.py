@@ -0,0 +1,117 @@
+import math
+from array import array
+
+from routing_table import UNREACHABLE
+
+EXACT_STOPS = 10
+MAX_STOPS = 60
+INFINITY = math.inf
+
+
+class RoomDistances:
+    def __init__(self, table, names):
+        # matrix[i * n + j] is the walking distance from room i to room j,
+        # over the rooms of one tour, read out of each room's tree.
+        self.version = table.version
+        self.table = table
+        self.names = list(dict.fromkeys(names))
+        self.index = {name: i for i, name in enumerate(self.names)}
+        count = len(self.names)
+        self.matrix = array('i', [UNREACHABLE]) * (count * count)
+        cells = [table.rooms[name] for name in self.names]
+        for j, name in enumerate(self.names):
+            distance = table.tree(name)[1]
+            for i, cell in enumerate(cells):
+                self.matrix[i * count + j] = distance[cell]
+
+    def distance(self, start_room, end_room):
+        value = self.matrix[self.index[start_room] * len(self.names) + self.index[end_room]]
+        return INFINITY if value == UNREACHABLE else value
+
+
+def _tour_cost(distance, order):
+    return sum(distance(a, b) for a, b in zip(order, order[1:]))
+
+
+def _held_karp(distance, start, stops, end):
+    # Exact dynamic programme over subsets of the stops. best[(mask, i)] is
+    # the cheapest walk from start through the stops in mask ending at i.
+    count = len(stops)
+    best = {}
+    for i, stop in enumerate(stops):
+        best[(1 << i, i)] = (distance(start, stop), None)
+    for mask in range(1, 1 << count):
+        for last in range(count):
+            entry = best.get((mask, last))
+            if entry is None or not mask & (1 << last):
+                continue
+            cost = entry[0]
+            for following in range(count):
+                if mask & (1 << following):
+                    continue
+                key = (mask | (1 << following), following)
+                new_cost = cost + distance(stops[last], stops[following])
+                if key not in best or new_cost < best[key][0]:
+                    best[key] = (new_cost, last)
+
+    full = (1 << count) - 1
+
+    def finish(i):
+        return best[(full, i)][0] + (distance(stops[i], end) if end is not None else 0)
+
+    last = min(range(count), key=finish)
+    order = []
+    mask = full
+    while last is not None:
+        order.append(stops[last])
+        previous = best[(mask, last)][1]
+        mask &= ~(1 << last)
+        last = previous
+    return order[::-1]
+
+
+def _nearest_neighbour(distance, start, stops):
+    order = []
+    remaining = list(stops)
+    current = start
+    while remaining:
+        current = min(remaining, key=lambda stop: distance(current, stop))
+        remaining.remove(current)
+        order.append(current)
+    return order
+
+
+def _two_opt(distance, order, fixed_end):
+    # Reverse stretches of the visiting order while that shortens the tour.
+    # Each candidate is costed in full rather than by the usual four-edge
+    # delta, which assumes distances are the same both ways.
+    best_cost = _tour_cost(distance, order)
+    improved = True
+    while improved:
+        improved = False
+        last = len(order) - (1 if fixed_end else 0)
+        for i in range(1, last - 1):
+            for j in range(i + 1, last):
+                candidate = order[:i] + order[i:j + 1][::-1] + order[j + 1:]
+                cost = _tour_cost(distance, candidate)
+                if cost < best_cost:
+                    order, best_cost = candidate, cost
+                    improved = True
+    return order
+
+
+def plan_tour(distances, start, stops, end=None):
+    # Returns the rooms in visiting order, from start through every stop,
+    # and on to end when one is given.
+    stops = [stop for stop in dict.fromkeys(stops) if stop not in (start, end)]
+    if not stops:
+        order = [start]
+    elif len(stops) <= EXACT_STOPS:
+        order = [start] + _held_karp(distances.distance, start, stops, end)
+    else:
+        order = [start] + _nearest_neighbour(distances.distance, start, stops)
+    if end is not None:
+        order.append(end)
+    if len(stops) > EXACT_STOPS:
+        order = _two_opt(distances.distance, order, end is not None)
+    return order, _tour_cost(distances.distance, order)
@@ -7,62 +7,31 @@ function NavigationPage() {
   const [endRoom, setEndRoom] = useState('');
   const [route, setRoute] = useState(null);
   const [error, setError] = useState('');
-  const [map, setMap] = useState([]);
+  const [map, setMap] = useState({});
 
-  const findRoute = () => {
-    const startPromise = fetch('http://localhost:8000/get_room_coordinates', {
-      method: 'POST',
-      headers: {
-        'Content-Type': 'application/json',
-      },
-      body: JSON.stringify({ room_name: startRoom }),
-    }).then((response) => response.json());
-  
-    const endPromise = fetch('http://localhost:8000/get_room_coordinates', {
-      method: 'POST',
-      headers: {
-        'Content-Type': 'application/json',
-      },
-      body: JSON.stringify({ room_name: endRoom }),
-    }).then((response) => response.json());
-  
-    Promise.all([startPromise, endPromise])
-      .then(([startResponse, endResponse]) => {
-        console.log('Start response:', startResponse);
-        console.log('End response:', endResponse);
-  
-        return fetch('http://localhost:8000/find_route', {
-          method: 'POST',
-          headers: {
-            'Content-Type': 'application/json',
-          },
-          body: JSON.stringify({
-            start_room: startRoom,
-            end_room: endRoom,
-          }),
-        });
-      })
-      .then((routeResponse) => {
-        console.log('Route response:', routeResponse);
-        return routeResponse.json();
-      })
-      .then((data) => {
-        console.log('Route data:', data);
-        setRoute(data.route);
-        setError('');
-      })
-      .catch((err) => {
-        console.error('Error in findRoute:', err);
-        setError(err.response?.data?.detail || 'An error occurred in findRoute');
-        setRoute(null);
+  const findRoute = async () => {
+    // One round trip: /navigate returns both rooms, the route and just the
+    // floors the route crosses.
+    try {
+      const response = await axios.post('http://localhost:8000/navigate', {
+        start_room: startRoom,
+        end_room: endRoom,
       });
+      console.log('Navigate data:', response.data);
+      setRoute(response.data.route);
+      setMap(response.data.floors);
+      setError('');
+    } catch (err) {
+      console.error('Error in findRoute:', err);
+      setError(err.response?.data?.detail || 'An error occurred in findRoute');
+      setRoute(null);
+    }
   };
-  
 
   const getMap = async () => {
     try {
       const response = await axios.get('http://localhost:8000/print_map');
-      setMap(response.data);
+      setMap(Object.fromEntries(response.data.map((floor, floorIndex) => [floorIndex, floor])));
     } catch (err) {
       console.error('Error fetching map:', err);
     }
@@ -101,7 +70,7 @@ function NavigationPage() {
       )}
       <div>
         <h2>Map:</h2>
-        {map.map((floor, floorIndex) => (
+        {Object.entries(map).map(([floorIndex, floor]) => (
           <div key={floorIndex}>
             <h3>Floor {floorIndex}</h3>
             <pre>{JSON.stringify(floor, null, 2)}</pre>